@@ -1,6 +1,10 @@
 from django.contrib import admin
-from django.db.models import Avg, F
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.paginator import Paginator
+from django.db.models import Max, Q, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 from tracking.models import (
@@ -18,6 +22,8 @@ from tracking.models import (
     WebsiteMappingValue,
     UPRRToken
 )
+from tracking.pagination import InvalidCursor, decode_cursor, encode_cursor
+from tracking.rollups import LEG_CHOICES, RequestKPIRollup, day_start, latency_percentiles
 
 admin.site.register(Notification)
 admin.site.register(Website)
@@ -94,152 +100,221 @@ class DateFilter(admin.SimpleListFilter):
         return queryset
 
 
+class KeysetCursorFilter(admin.SimpleListFilter):
+    # hidden filter carrying the keyset cursor of the next page, so paging
+    # through raw rows never needs an OFFSET
+    title = _("Page")
+    parameter_name = "after"
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return False
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                created_at, pk = decode_cursor(self.value())
+            except InvalidCursor as ex:
+                raise IncorrectLookupParameters(ex)
+            return queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return queryset
+
+
+class CappedCountPaginator(Paginator):
+    # counts at most one page window instead of the whole table
+    count_limit = 1000
+
+    @cached_property
+    def count(self):
+        return self.object_list[: self.count_limit].count()
+
+
+def get_date_range(request):
+    today = timezone.now().date()
+    date_filter = request.GET.get("date")
+    if date_filter == "Todays":
+        return today, today
+    elif date_filter == "Past 7 days":
+        return today - timezone.timedelta(days=7), today
+    elif date_filter == "This month":
+        return today - timezone.timedelta(days=30), today
+    elif date_filter == "This year":
+        return today - timezone.timedelta(days=365), today
+    return None
+
+
 class RequestKPIAdmin(admin.ModelAdmin):
-    list_filter = (WebsiteNameFilter, DateFilter)
-    list_per_page = 999999
+    list_filter = (WebsiteNameFilter, DateFilter, KeysetCursorFilter)
+    list_per_page = 100
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    ordering = ("-created_at", "-id")
     change_list_template = "tracking/custom_kpi_template.html"
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
 
-        if request.GET.getlist("website_name"):
-            return qs.filter(website__name=request.GET.getlist("website_name")[0])
-        elif request.GET.getlist("date"):
-            today = timezone.now().date()
-            if request.GET.getlist("date")[0] == "Todays":
-                return qs.filter(created_at__date=today)
-            elif request.GET.getlist("date")[0] == "Past 7 days":
-                seven_days_ago = today - timezone.timedelta(days=7)
-                return qs.filter(created_at__date__range=[seven_days_ago, today])
-            elif request.GET.getlist("date")[0] == "This month":
-                one_month_ago = today - timezone.timedelta(days=30)
-                return qs.filter(created_at__date__range=[one_month_ago, today])
-            elif request.GET.getlist("date")[0] == "This year":
-                one_year_ago = today - timezone.timedelta(days=365)
-                return qs.filter(created_at__date__range=[one_year_ago, today])
+        if request.GET.get("website_name"):
+            qs = qs.filter(website__name=request.GET.get("website_name"))
+        date_range = get_date_range(request)
+        if date_range:
+            qs = qs.filter(
+                created_at__gte=day_start(date_range[0]),
+                created_at__lt=day_start(date_range[1] + timezone.timedelta(days=1)),
+            )
         return qs
 
-    def count_get_request_dunt_to_tmdb(self, obj):
-        return obj.filter(sender="tracking", receiver="TMDB", method="GET").count()
-
-    def count_post_request_dunt_to_api(self, obj):
-        return obj.filter(
-            sender="tracking", receiver=obj.first().website.name, method="POST"
-        ).count()
-
-    def count_post_request_dunt_to_tmdb(self, obj):
-        return obj.filter(sender="tracking", receiver="TMDB", method="POST").count()
+    # all KPI figures come from the daily RequestKPIRollup rows, aggregated
+    # once per request
+    def get_kpi_totals(self, request):
+        if not hasattr(request, "_kpi_totals"):
+            rollups = RequestKPIRollup.objects.all()
+            if request.GET.get("website_name"):
+                rollups = rollups.filter(website__name=request.GET.get("website_name"))
+            date_range = get_date_range(request)
+            if date_range:
+                rollups = rollups.filter(day__range=date_range)
+            totals = rollups.aggregate(
+                get_dt_tmdb_count=Coalesce(Sum("tmdb_get_count"), 0),
+                post_dt_vp_count=Coalesce(Sum("api_post_count"), 0),
+                post_dt_tmdb_count=Coalesce(Sum("tmdb_post_count"), 0),
+                request_count=Coalesce(Sum("request_count"), 0),
+                containers_pulled_from_tmdb=Coalesce(Sum("containers_pulled_from_tmdb"), 0),
+                containers_data_get_from_api=Coalesce(Sum("containers_data_get_from_api"), 0),
+                containers_pushed_to_tmdb=Coalesce(Sum("containers_pushed_to_tmdb"), 0),
+                total_duration=Sum("total_duration"),
+                tmdb_get_duration=Sum("tmdb_get_duration"),
+                api_post_duration=Sum("api_post_duration"),
+                tmdb_post_duration=Sum("tmdb_post_duration"),
+                last_tmdb_get_start=Max("last_tmdb_get_start"),
+                last_tmdb_post_stop=Max("last_tmdb_post_stop"),
+            )
+            totals["overall_average"] = average(totals["total_duration"], totals["request_count"])
+            totals["first_leg_average"] = average(totals["tmdb_get_duration"], totals["get_dt_tmdb_count"])
+            totals["second_leg_average"] = average(totals["api_post_duration"], totals["post_dt_vp_count"])
+            totals["third_leg_average"] = average(totals["tmdb_post_duration"], totals["post_dt_tmdb_count"])
+            request._kpi_totals = totals
+        return request._kpi_totals
+
+    # p50/p95/p99 per leg, merged from the latency sketches
+    def get_leg_percentiles(self, request):
+        filters = {}
+        if request.GET.get("website_name"):
+            filters["website__name"] = request.GET.get("website_name")
+        date_range = get_date_range(request)
+        if date_range:
+            filters["from_date"] = day_start(date_range[0])
+            filters["to_date"] = day_start(date_range[1] + timezone.timedelta(days=1))
+        percentiles = {}
+        for leg, label in LEG_CHOICES:
+            quantiles = latency_percentiles(leg, **filters)
+            percentiles[label] = {
+                f"p{round(q * 100)}": round(value, 2) if value is not None else None
+                for q, value in quantiles.items()
+            }
+        return percentiles
+
+    def count_get_request_dunt_to_tmdb(self, totals):
+        return totals["get_dt_tmdb_count"]
+
+    def count_post_request_dunt_to_api(self, totals):
+        return totals["post_dt_vp_count"]
+
+    def count_post_request_dunt_to_tmdb(self, totals):
+        return totals["post_dt_tmdb_count"]
 
     # Count of containers pulled from TMDB
-    def containers_pulled_from_tmdb(self, obj):
-        queryset = obj.filter(sender="tracking", receiver="TMDB", method="GET")
-        return sum(int(obj.containers or 0) for obj in queryset)
+    def containers_pulled_from_tmdb(self, totals):
+        return totals["containers_pulled_from_tmdb"]
 
     # Count of containers data from Vaports
-    def containers_data_get_from_api(self, obj):
-        queryset = obj.filter(
-            sender="tracking", receiver=obj.first().website.name, method="POST"
-        )
-        return sum(int(obj.containers or 0) for obj in queryset)
+    def containers_data_get_from_api(self, totals):
+        return totals["containers_data_get_from_api"]
 
     # Count of containers pushed to TMDB
-    def containers_pushed_to_tmdb(self, obj):
-        queryset = obj.filter(sender="tracking", receiver="TMDB", method="POST")
-        return sum(int(obj.containers or 0) for obj in queryset)
+    def containers_pushed_to_tmdb(self, totals):
+        return totals["containers_pushed_to_tmdb"]
 
     # Get Overall average
-    def get_overall_average_time(self, obj):
-        return round(
-            obj.aggregate(average_time_diff=Avg(F("stop_time") - F("start_time")))[
-                "average_time_diff"
-            ].total_seconds(),
-            2,
-        )
+    def get_overall_average_time(self, totals):
+        return average_seconds(totals["overall_average"])
 
     # Get Overall average
-    def get_last_average_time(self, obj):
-        first_object = (
-            obj.filter(sender="tracking", receiver="TMDB", method="GET")
-            .last()
-            .start_time
-        )
-        last_object = (
-            obj.filter(sender="tracking", receiver="TMDB", method="POST")
-            .last()
-            .stop_time
-        )
+    def get_last_average_time(self, totals):
         try:
-            total_seconds = round((last_object - first_object).total_seconds(), 2)
-        except:
+            total_seconds = round(
+                (totals["last_tmdb_post_stop"] - totals["last_tmdb_get_start"]).total_seconds(), 2
+            )
+        except TypeError:
             total_seconds = "Calculating"
         return total_seconds
 
     # First Leg RoundTrip
-    def get_first_leg_average_time(self, obj):
-        return round(
-            obj.filter(sender="tracking", receiver="TMDB", method="GET")
-            .aggregate(average_time_diff=Avg(F("stop_time") - F("start_time")))[
-                "average_time_diff"
-            ]
-            .total_seconds(),
-            2,
-        )
+    def get_first_leg_average_time(self, totals):
+        return average_seconds(totals["first_leg_average"])
 
     # Second Leg RoundTrip
-    def get_second_leg_average_time(self, obj):
-        return round(
-            obj.filter(
-                sender="tracking", receiver=obj.first().website.name, method="POST"
-            )
-            .aggregate(average_time_diff=Avg(F("stop_time") - F("start_time")))[
-                "average_time_diff"
-            ]
-            .total_seconds(),
-            2,
-        )
+    def get_second_leg_average_time(self, totals):
+        return average_seconds(totals["second_leg_average"])
 
     # Third Leg RoundTrip
-    def get_third_leg_average_time(self, obj):
-        return round(
-            obj.filter(sender="tracking", receiver="TMDB", method="POST")
-            .aggregate(average_time_diff=Avg(F("stop_time") - F("start_time")))[
-                "average_time_diff"
-            ]
-            .total_seconds(),
-            2,
-        )
+    def get_third_leg_average_time(self, totals):
+        return average_seconds(totals["third_leg_average"])
 
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         extra_context["show_full_result_count"] = False
-        obj = self.get_queryset(request)
+        totals = self.get_kpi_totals(request)
 
-        extra_context["get_dt_tmdb_count"] = self.count_get_request_dunt_to_tmdb(obj)
-        extra_context["post_dt_vp_count"] = self.count_post_request_dunt_to_api(obj)
-        extra_context["post_dt_tmdb_count"] = self.count_post_request_dunt_to_tmdb(obj)
+        extra_context["get_dt_tmdb_count"] = self.count_get_request_dunt_to_tmdb(totals)
+        extra_context["post_dt_vp_count"] = self.count_post_request_dunt_to_api(totals)
+        extra_context["post_dt_tmdb_count"] = self.count_post_request_dunt_to_tmdb(totals)
 
         extra_context["containers_pulled_from_tmdb"] = self.containers_pulled_from_tmdb(
-            obj
+            totals
         )
         extra_context[
             "containers_data_get_from_api"
-        ] = self.containers_data_get_from_api(obj)
-        extra_context["containers_pushed_to_tmdb"] = self.containers_pushed_to_tmdb(obj)
+        ] = self.containers_data_get_from_api(totals)
+        extra_context["containers_pushed_to_tmdb"] = self.containers_pushed_to_tmdb(totals)
 
-        extra_context["get_overall_average_time"] = self.get_overall_average_time(obj)
-        extra_context["get_last_average_time"] = self.get_last_average_time(obj)
+        extra_context["get_overall_average_time"] = self.get_overall_average_time(totals)
+        extra_context["get_last_average_time"] = self.get_last_average_time(totals)
 
         extra_context["get_first_leg_average_time"] = self.get_first_leg_average_time(
-            obj
+            totals
         )
         extra_context["get_second_leg_average_time"] = self.get_second_leg_average_time(
-            obj
+            totals
         )
         extra_context["get_third_leg_average_time"] = self.get_third_leg_average_time(
-            obj
+            totals
         )
 
-        return super().changelist_view(request, extra_context=extra_context)
+        extra_context["leg_percentiles"] = self.get_leg_percentiles(request)
+
+        response = super().changelist_view(request, extra_context=extra_context)
+        context = getattr(response, "context_data", None)
+        if context and "cl" in context:
+            results = list(context["cl"].result_list)
+            if len(results) == self.list_per_page:
+                cursor = encode_cursor(results[-1].created_at, results[-1].pk)
+                context["next_page_url"] = context["cl"].get_query_string({"after": cursor}, ["p"])
+        return response
+
+
+def average(duration, count):
+    if duration is None or not count:
+        return None
+    return duration / count
+
+
+def average_seconds(duration):
+    if duration is None:
+        return 0
+    return round(duration.total_seconds(), 2)
 
 
 admin.site.register(RequestKPI, RequestKPIAdmin)
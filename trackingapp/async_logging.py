@@ -0,0 +1,146 @@
+import logging
+import os
+import queue
+import threading
+import traceback
+
+from django.conf import settings
+
+from tracking.Crawler.logging_handler import FileLogHandler
+from tracking.exit_hooks import on_process_exit
+
+logger = logging.getLogger(__name__)
+
+# Queue-backed FileLogHandler. Calls on the crawling thread only put the
+# message on a bounded queue; one listener thread per process does the
+# FileLogHandler formatting and file writes. When the queue is full the line
+# is dropped and counted instead of blocking the crawler.
+#
+#   tracking_ASYNC_CRAWLER_LOGGING = True
+#   tracking_CRAWLER_LOG_QUEUE_SIZE = 10000
+
+QUEUE_SIZE = getattr(settings, "tracking_CRAWLER_LOG_QUEUE_SIZE", 10000)
+LOG_METHODS = ("debug", "info", "warn", "warning", "error", "critical")
+
+_STOP = object()
+
+
+class LogListener:
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.written = 0
+        self.failed = 0
+        # website name -> dropped lines
+        self.dropped = {}
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="crawler-log-listener", daemon=True)
+                self.thread.start()
+
+    def put(self, handler, method, args, kwargs):
+        try:
+            self.queue.put_nowait((handler, method, args, kwargs))
+        except queue.Full:
+            name = str(getattr(handler, "website", None))
+            with self.lock:
+                self.dropped[name] = self.dropped.get(name, 0) + 1
+            return False
+        return True
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                handler, method, args, kwargs = item
+                getattr(handler, method)(*args, **kwargs)
+                self.written += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Crawler log write failed")
+            finally:
+                self.queue.task_done()
+
+    # blocks until everything queued so far is written
+    def flush(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def stop(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout=10)
+        dropped = self.stats()["dropped"]
+        if dropped:
+            logger.warning(f"Crawler log queue was full, dropped lines per website: {dropped}")
+
+    def stats(self):
+        with self.lock:
+            dropped = dict(self.dropped)
+        return {
+            "queued": self.queue.qsize(),
+            "maxsize": self.queue.maxsize,
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": dropped,
+            "dropped_total": sum(dropped.values()),
+        }
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def get_listener():
+    # keyed by pid: a listener thread does not survive a worker fork
+    pid = os.getpid()
+    listener = _listeners.get(pid)
+    if listener is None:
+        with _listeners_lock:
+            listener = _listeners.get(pid)
+            if listener is None:
+                listener = _listeners[pid] = LogListener()
+    listener.start()
+    return listener
+
+
+@on_process_exit
+def stop_listener():
+    listener = _listeners.get(os.getpid())
+    if listener is not None:
+        listener.stop()
+
+
+# drop-in for FileLogHandler: same constructor and logging methods
+class AsyncFileLogHandler:
+    def __init__(self, *args, **kwargs):
+        self.handler = FileLogHandler(*args, **kwargs)
+        self.listener = get_listener()
+
+    def __getattr__(self, name):
+        if name == "handler":
+            raise AttributeError(name)
+        if name == "exception":
+            # the traceback is gone by the time the listener runs
+            def log(msg, *args, **kwargs):
+                return self.listener.put(self.handler, "error", (f"{msg}\n{traceback.format_exc()}",) + args, kwargs)
+            return log
+        if name in LOG_METHODS:
+            def log(*args, **kwargs):
+                return self.listener.put(self.handler, name, args, kwargs)
+            return log
+        return getattr(self.handler, name)
+
+    def flush(self):
+        self.listener.flush()
+
+
+def get_file_logger(*args, **kwargs):
+    if getattr(settings, "tracking_ASYNC_CRAWLER_LOGGING", True):
+        return AsyncFileLogHandler(*args, **kwargs)
+    return FileLogHandler(*args, **kwargs)
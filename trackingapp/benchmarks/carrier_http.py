@@ -0,0 +1,77 @@
+# Requests/s and TCP connections opened against a local keep-alive stub
+# server: bare requests.post (how the token calls used to work) versus the
+# pooled CarrierSession.
+#
+#   DJANGO_SETTINGS_MODULE=<project>.settings python -m tracking.benchmarks.carrier_http [requests] [threads]
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+import requests
+
+django.setup()
+
+from tracking.carrier_http import CarrierSession  # noqa: E402
+
+BODY = b'{"access_token": "token", "expires_in": 3600, "token_type": "Bearer"}'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes; without TCP_NODELAY the
+    # delayed-ACK stall would dominate every keep-alive request
+    disable_nagle_algorithm = True
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StubHandler.lock:
+            StubHandler.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(label, post, url, count, threads):
+    StubHandler.connections = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for response in executor.map(lambda _: post(url), range(count)):
+            response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:>8}: {count} requests in {elapsed:6.2f}s = {count / elapsed:8.0f} req/s, "
+        f"{StubHandler.connections} connections opened"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/oauth/token"
+    data = {"grant_type": "client_credentials"}
+
+    run("bare", lambda url: requests.post(url, data=data), url, count, threads)
+    session = CarrierSession("benchmark", pool_maxsize=threads)
+    run("pooled", lambda url: session.post(url, data=data), url, count, threads)
+    session.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Rows/s normalising carrier timestamp columns to the DB2 format:
+# parser.parse on every value (how convert_string_into_db2_format used to
+# work) versus tracking.dates with its per-field format cache, row by row
+# and as a batch.
+#
+#   python -m tracking.benchmarks.date_normalisation [rows]
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import dateutil.parser as parser
+
+from tracking import dates
+
+COLUMNS = {
+    "uprr.eta": "%Y-%m-%dT%H:%M:%S",
+    "csx.last_event": "%m/%d/%Y %I:%M %p",
+    "gpa.available": "%d-%b-%Y %H:%M",
+}
+
+
+def make_column(date_format, rows):
+    start = datetime(2024, 1, 1)
+    return [(start + timedelta(minutes=random.randrange(525600))).strftime(date_format) for _ in range(rows)]
+
+
+def run(label, convert, columns, rows):
+    started = time.perf_counter()
+    results = {key: convert(key, values) for key, values in columns.items()}
+    elapsed = time.perf_counter() - started
+    total = rows * len(columns)
+    print(f"{label:>14}: {total} values in {elapsed:6.2f}s = {total / elapsed:10.0f} rows/s")
+    return results
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    random.seed(0)
+    columns = {key: make_column(date_format, rows) for key, date_format in COLUMNS.items()}
+
+    expected = run(
+        "parser.parse", lambda key, values: [parser.parse(v).strftime(dates.DB2_FORMAT) for v in values], columns, rows
+    )
+    dates.forget_formats()
+    per_row = run("normalize_date", lambda key, values: [dates.normalize_date(v, key) for v in values], columns, rows)
+    dates.forget_formats()
+    batch = run("normalize_dates", lambda key, values: dates.normalize_dates(values, key), columns, rows)
+    assert per_row == expected and batch == expected, "results differ from parser.parse"
+    print(f"learned: {dates.learned_formats()}")
+
+    # a value shorter than the learned layout must not be split differently
+    dates.forget_formats()
+    dates.normalize_date("20240105123000", "compact")
+    for value in ("202401051230", "20240105"):
+        expected = parser.parse(value).strftime(dates.DB2_FORMAT)
+        assert dates.normalize_date(value, "compact") == expected, f"{value} differs from parser.parse"
+
+
+if __name__ == "__main__":
+    main()
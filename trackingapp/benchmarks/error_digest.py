@@ -0,0 +1,100 @@
+# Emails and SMTP connections for a burst of trace errors, sent to a local
+# SMTP stand-in: one send_mail per error (how send_error_email used to work)
+# versus ErrorDigest.
+#
+#   DJANGO_SETTINGS_MODULE=<project>.settings python -m tracking.benchmarks.error_digest [errors] [websites]
+import socketserver
+import sys
+import threading
+import time
+
+import django
+
+django.setup()
+
+from django.core.mail import get_connection, send_mail  # noqa: E402
+
+from tracking.notifications import ErrorDigest, LocalDigestStore  # noqa: E402
+
+RECIPIENTS = ["ops@example.com"]
+
+
+class SMTPStandIn(socketserver.StreamRequestHandler):
+    connections = 0
+    messages = 0
+    lock = threading.Lock()
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        with SMTPStandIn.lock:
+            SMTPStandIn.connections += 1
+        self.reply("220 localhost stand-in")
+        while line := self.rfile.readline():
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with SMTPStandIn.lock:
+                    SMTPStandIn.messages += 1
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+def run(label, send, errors):
+    SMTPStandIn.connections = SMTPStandIn.messages = 0
+    started = time.perf_counter()
+    send(errors)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:>9}: {len(errors)} errors in {elapsed:6.2f}s, "
+        f"{SMTPStandIn.messages} emails over {SMTPStandIn.connections} SMTP connections"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    websites = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPStandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def connect():
+        return get_connection("django.core.mail.backends.smtp.EmailBackend", host="127.0.0.1", port=server.server_address[1])
+
+    errors = [(f"website-{i % websites}", f"<p>Container MSCU{i % 50:07d} not found</p>") for i in range(count)]
+
+    def per_error(errors):
+        for website_name, html in errors:
+            send_mail(
+                subject=f"[tracking] Trace Error Notification - {website_name}",
+                message=html,
+                from_email="dun.system.messages@client.com",
+                recipient_list=RECIPIENTS,
+                html_message=html,
+                connection=connect(),
+            )
+
+    def digest(errors):
+        digest = ErrorDigest(
+            window=300, connection_factory=connect, get_recipients=lambda: RECIPIENTS, store=LocalDigestStore()
+        )
+        for website_name, html in errors:
+            digest.add(website_name, html)
+        digest.flush(force=True)
+
+    run("per-error", per_error, errors)
+    run("digest", digest, errors)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
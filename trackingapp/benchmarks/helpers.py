@@ -0,0 +1,59 @@
+# Micro-benchmarks of the hot tracking.helpers with strict_hint checks on and
+# off (tracking_STRICT_HELPERS), and of the batch variants against a loop of
+# single calls. Times are per value.
+#
+#   DJANGO_SETTINGS_MODULE=<project>.settings python -m tracking.benchmarks.helpers [values]
+import importlib
+import random
+import sys
+import timeit
+
+import django
+
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+
+from tracking import dates, helpers  # noqa: E402
+
+
+def load_helpers(strict):
+    # the decorator is picked when the module is imported
+    with override_settings(tracking_STRICT_HELPERS=strict):
+        return importlib.reload(helpers)
+
+
+def per_value(statement, count, number=5):
+    return min(timeit.repeat(statement, number=number, repeat=3)) / number / count * 1e9
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(0)
+    statuses = [random.choice(["Released", " RELEASED ", "hold", "", None]) for _ in range(count)]
+    texts = [status or " " for status in statuses]
+    timestamps = [f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}T10:15:00" for _ in range(count)]
+
+    cases = {}
+    for strict in (True, False):
+        module = load_helpers(strict)
+        label = "strict" if strict else "plain"
+        cases[f"stri_compare ({label})"] = lambda m=module: [m.stri_compare(s, "released") for s in statuses]
+        cases[f"is_null_or_empty ({label})"] = lambda m=module: [m.is_null_or_empty(t) for t in texts]
+        cases[f"format_date ({label})"] = lambda m=module: [m.format_date(t, key="bench") for t in timestamps]
+        cases[f"convert_string_into_db2_format ({label})"] = lambda m=module: [
+            m.convert_string_into_db2_format(t, key="bench") for t in timestamps
+        ]
+    module = load_helpers(False)
+    cases["stri_compare_many"] = lambda: module.stri_compare_many(statuses, "released")
+    cases["stri_compare_pairs"] = lambda: module.stri_compare_pairs(statuses, ["released"] * count)
+    cases["is_null_or_empty_many"] = lambda: module.is_null_or_empty_many(texts)
+    cases["normalize_dates"] = lambda: dates.normalize_dates(timestamps, "bench")
+
+    assert module.stri_compare_many(statuses, "released") == [module.stri_compare(s, "released") for s in statuses]
+    for label, statement in cases.items():
+        print(f"{label:>42}: {per_value(statement, count):8.0f} ns/value")
+
+
+if __name__ == "__main__":
+    main()
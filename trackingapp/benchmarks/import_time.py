@@ -0,0 +1,38 @@
+# Cold import time of tracking.tasks (what every web and Celery process pays
+# at startup) versus resolving every registered crawler class, each measured
+# in a fresh interpreter.
+#
+#   DJANGO_SETTINGS_MODULE=<project>.settings python -m tracking.benchmarks.import_time [runs]
+import statistics
+import subprocess
+import sys
+
+SETUP = "import django; django.setup(); import time; started = time.perf_counter(); "
+
+SCENARIOS = {
+    "import tracking.tasks": "import tracking.tasks; ",
+    "+ resolve all crawlers": (
+        "import tracking.tasks as tasks; "
+        "[tasks.crawler_classes[name] for name in tasks.crawler_classes]; "
+    ),
+}
+
+
+def measure(statement):
+    code = SETUP + statement + "print(time.perf_counter() - started)"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for label, statement in SCENARIOS.items():
+        timings = [measure(statement) for _ in range(runs)]
+        print(
+            f"{label:>24}: median {statistics.median(timings) * 1000:8.1f} ms, "
+            f"min {min(timings) * 1000:8.1f} ms over {runs} runs"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Rows per second for each report writer on synthetic TraceReportLog rows.
+#
+#   DJANGO_SETTINGS_MODULE=<project>.settings python -m tracking.benchmarks.report_writers [rows]
+import io
+import sys
+import time
+import tracemalloc
+
+import django
+
+django.setup()
+
+from tracking import reports  # noqa: E402
+
+# .xls tops out at 65,536 rows and pisa renders the whole document at once
+ROW_LIMITS = {"xls": 60000, "xlsx": None, "pdf": 2000}
+
+
+def synthetic_items(count):
+    for index in range(count):
+        yield {
+            "name": f"Website {index % 12}",
+            "status": "Active",
+            "category": "Imports",
+            "created_at": "2024-01-01 10:15:00 AM",
+            "units_traced": 100 + index % 50,
+            "success": 90 + index % 10,
+        }
+
+
+def run(file_format, count):
+    writer = reports.WRITERS[file_format]
+    dest = io.BytesIO()
+    tracemalloc.start()
+    started = time.perf_counter()
+    writer(synthetic_items(count), reports.UNITTRACES, "2024-01-01", "2024-03-31", dest)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # the BytesIO destination is part of the peak; subtract it to see the writer itself
+    writer_peak = max(peak - dest.tell(), 0)
+    print(
+        f"{file_format:>5}: {count:>8} rows in {elapsed:7.2f}s "
+        f"= {count / elapsed:>10.0f} rows/s, output {dest.tell() / 1e6:7.2f} MB, "
+        f"writer peak {writer_peak / 1e6:7.2f} MB"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    for file_format, limit in ROW_LIMITS.items():
+        run(file_format, min(count, limit) if limit else count)
+
+
+if __name__ == "__main__":
+    main()
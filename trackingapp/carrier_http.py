@@ -0,0 +1,111 @@
+import os
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+from tracking import ratelimit
+
+# One pooled, keep-alive session per carrier and process. Options come from
+# tracking_CARRIER_HTTP, e.g.
+#
+#   tracking_CARRIER_HTTP = {
+#       "default": {"timeout": (5, 60), "retries": 3},
+#       "uprr": {"pool_maxsize": 20},
+#   }
+
+DEFAULT_OPTIONS = {
+    # (connect, read) seconds
+    "timeout": (5, 60),
+    "retries": 3,
+    "backoff_factor": 0.5,
+    "status_forcelist": (429, 500, 502, 503, 504),
+    "pool_connections": 10,
+    "pool_maxsize": 10,
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class CarrierSession(requests.Session):
+    def __init__(self, carrier, **options):
+        super().__init__()
+        options = {**DEFAULT_OPTIONS, **options}
+        self.carrier = carrier
+        self.timeout = options["timeout"]
+        # connection errors are retried for every method, read errors and
+        # retryable statuses only for idempotent ones (urllib3's default)
+        self.retry = Retry(
+            total=options["retries"],
+            backoff_factor=options["backoff_factor"],
+            status_forcelist=options["status_forcelist"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        # urllib3 re-sends inside one rate-limit acquisition; for limited
+        # carriers status retries happen in request() instead, taking a token
+        # per attempt, and read errors (the request may have reached the
+        # carrier) are not retried
+        self.limited = ratelimit.get_limiter(carrier) is not None
+        if self.limited:
+            # connect retries only; nothing that reached the carrier is re-sent
+            adapter_retry = self.retry.new(
+                read=0, status=0, status_forcelist=(), respect_retry_after_header=False
+            )
+        else:
+            adapter_retry = self.retry
+        # urllib3 keeps one connection pool per host inside the adapter
+        adapter = HTTPAdapter(
+            pool_connections=options["pool_connections"],
+            pool_maxsize=options["pool_maxsize"],
+            max_retries=adapter_retry,
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if not self.limited:
+            return super().request(method, url, **kwargs)
+        retry = self.retry
+        while True:
+            # shared per-carrier rate limit and concurrency cap, see tracking.ratelimit
+            with ratelimit.limit(self.carrier):
+                response = super().request(method, url, **kwargs)
+            if not retry.is_retry(method, response.status_code, "Retry-After" in response.headers):
+                return response
+            try:
+                retry = retry.increment(method, url, response=response.raw)
+            except MaxRetryError:
+                return response
+            response.close()
+            # back off outside the concurrency slot
+            retry.sleep(response.raw)
+
+
+def carrier_options(carrier):
+    configured = getattr(settings, "tracking_CARRIER_HTTP", {})
+    return {**configured.get("default", {}), **configured.get(carrier, {})}
+
+
+def get_session(carrier="default"):
+    # keyed by pid so a session created before a worker fork is never shared
+    key = (carrier, os.getpid())
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = CarrierSession(carrier, **carrier_options(carrier))
+    return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
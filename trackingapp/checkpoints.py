@@ -0,0 +1,158 @@
+import uuid
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+# Durable per-chunk checkpoints for crawler runs. A run's batches are split
+# into chunks when it is planned; every chunk is traced by its own Celery
+# task and marked done when it finishes, so a run that times out or crashes
+# resumes from the chunks that are still open instead of starting over.
+# Batches are stored as JSON, so get_batches() has to yield JSON-serialisable
+# values (see tracking.executor).
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+STATUS_CHOICES = (
+    (PENDING, "Pending"),
+    (RUNNING, "Running"),
+    (DONE, "Done"),
+    (FAILED, "Failed"),
+)
+
+# batches per chunk; 0 disables chunking
+CHUNK_SIZE = getattr(settings, "tracking_CRAWLER_CHUNK_SIZE", 25)
+# a chunk that has been running longer than this is assumed lost
+CHUNK_TIMEOUT = getattr(settings, "tracking_CRAWLER_CHUNK_TIMEOUT", 900)
+MAX_ATTEMPTS = getattr(settings, "tracking_CRAWLER_CHUNK_MAX_ATTEMPTS", 3)
+KEEP_DAYS = 7
+
+
+class CrawlerRunChunk(models.Model):
+    run_id = models.CharField(max_length=32, db_index=True)
+    crawler = models.CharField(max_length=50)
+    chunk_index = models.IntegerField()
+    batches = models.JSONField()
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    units_traced = models.IntegerField(default=0)
+    success = models.IntegerField(default=0)
+    run_finished = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = "tracking"
+        unique_together = ("run_id", "chunk_index")
+        indexes = [models.Index(fields=["crawler", "run_finished"])]
+
+    def __str__(self):
+        return f"{self.crawler} {self.run_id} #{self.chunk_index} {self.status}"
+
+
+def plan_run(crawler, batches, chunk_size=CHUNK_SIZE):
+    run_id = uuid.uuid4().hex
+    batches = iter(batches)
+    chunks = []
+    while chunk := list(islice(batches, chunk_size)):
+        chunks.append(CrawlerRunChunk(run_id=run_id, crawler=crawler, chunk_index=len(chunks), batches=chunk))
+    CrawlerRunChunk.objects.bulk_create(chunks)
+    return run_id
+
+
+def get_unfinished_run(crawler):
+    return (
+        CrawlerRunChunk.objects.filter(crawler=crawler, run_finished=False)
+        .order_by("created_at")
+        .values_list("run_id", flat=True)
+        .first()
+    )
+
+
+# chunks of the run that need a (new) task: never dispatched, failed with
+# attempts left and not re-dispatched since, or dispatched / running for
+# longer than CHUNK_TIMEOUT. They are stamped as dispatched in the same
+# transaction, so a chunk that is already queued is not queued again.
+def dispatch_chunks(run_id):
+    now = timezone.now()
+    stale = now - timedelta(seconds=CHUNK_TIMEOUT)
+    with transaction.atomic():
+        chunk_indexes = list(
+            CrawlerRunChunk.objects.select_for_update()
+            .filter(run_id=run_id, attempts__lt=MAX_ATTEMPTS)
+            .filter(
+                models.Q(status=PENDING, dispatched_at__isnull=True)
+                | models.Q(status__in=[PENDING, FAILED], dispatched_at__lt=stale)
+                | models.Q(status=FAILED, dispatched_at__lte=models.F("finished_at"))
+                | models.Q(status=RUNNING, started_at__lt=stale, dispatched_at__lt=stale)
+            )
+            .values_list("chunk_index", flat=True)
+        )
+        CrawlerRunChunk.objects.filter(run_id=run_id, chunk_index__in=chunk_indexes).update(dispatched_at=now)
+    return chunk_indexes
+
+
+# claims the chunk for this worker; None when it is already done or claimed
+def start_chunk(run_id, chunk_index):
+    with transaction.atomic():
+        chunk = CrawlerRunChunk.objects.select_for_update().get(run_id=run_id, chunk_index=chunk_index)
+        stale = timezone.now() - timedelta(seconds=CHUNK_TIMEOUT)
+        if chunk.status == DONE or (chunk.status == RUNNING and chunk.started_at > stale):
+            return None
+        chunk.status = RUNNING
+        chunk.attempts += 1
+        chunk.started_at = timezone.now()
+        chunk.save(update_fields=["status", "attempts", "started_at"])
+    return chunk
+
+
+def finish_chunk(chunk, units_traced, success):
+    chunk.status = DONE
+    chunk.units_traced = units_traced
+    chunk.success = success
+    chunk.finished_at = timezone.now()
+    chunk.save(update_fields=["status", "units_traced", "success", "finished_at"])
+
+
+def fail_chunk(chunk):
+    chunk.status = FAILED
+    chunk.finished_at = timezone.now()
+    chunk.save(update_fields=["status", "finished_at"])
+
+
+# done, or given up on after MAX_ATTEMPTS (including a last attempt that
+# died while running)
+def is_settled(chunk, stale):
+    if chunk.status == DONE:
+        return True
+    if chunk.attempts < MAX_ATTEMPTS:
+        return False
+    return chunk.status == FAILED or (chunk.status == RUNNING and chunk.started_at < stale)
+
+
+# returns the run totals exactly once, to the worker that completes the last
+# chunk (or gives up on it); None otherwise
+def finish_run_if_complete(run_id):
+    with transaction.atomic():
+        chunks = list(CrawlerRunChunk.objects.select_for_update().filter(run_id=run_id, run_finished=False))
+        if not chunks:
+            return None
+        stale = timezone.now() - timedelta(seconds=CHUNK_TIMEOUT)
+        if not all(is_settled(chunk, stale) for chunk in chunks):
+            return None
+        CrawlerRunChunk.objects.filter(pk__in=[chunk.pk for chunk in chunks]).update(run_finished=True)
+    CrawlerRunChunk.objects.filter(
+        run_finished=True, created_at__lt=timezone.now() - timedelta(days=KEEP_DAYS)
+    ).delete()
+    return {
+        "units_traced": sum(chunk.units_traced for chunk in chunks),
+        "success": sum(chunk.success for chunk in chunks),
+        "failed_chunks": sum(chunk.status != DONE for chunk in chunks),
+    }
@@ -0,0 +1,118 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRequestError(Exception):
+    def __init__(self, message, response_text=""):
+        super().__init__(message)
+        self.response_text = response_text
+
+
+# A carrier credential (an access token string or the whole token payload)
+# shared by every process through the Django cache.
+#
+# Lookups are served from memory until ``refresh_margin`` seconds before
+# expiry. Refreshes are single-flight: the process that wins the cache lock
+# calls ``fetch`` and everyone else keeps using the current token, or waits
+# for the new one if there is none. ``fetch`` returns (token, expires_in)
+# and raises TokenRequestError on failure.
+class CachedToken:
+    def __init__(self, name, fetch, refresh_margin=None, lock_timeout=30, wait_timeout=30):
+        self.name = name
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin or getattr(settings, "tracking_TOKEN_REFRESH_MARGIN", 120)
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.cache_key = f"tracking:token:{name}"
+        self.lock_key = f"tracking:token:{name}:lock"
+        self._value = None
+        self._expires_at = 0
+        self._refresh_at = 0
+
+    def get(self):
+        if self._value and time.time() < self._refresh_at:
+            return self._value
+        self._load_shared()
+        if self._value and time.time() < self._refresh_at:
+            return self._value
+        return self.refresh()
+
+    def refresh(self):
+        deadline = time.time() + self.wait_timeout
+        while True:
+            if cache.add(self.lock_key, True, self.lock_timeout):
+                try:
+                    return self._fetch()
+                finally:
+                    cache.delete(self.lock_key)
+            # another process is refreshing; a token that has not expired
+            # yet is still good to use in the meantime
+            self._load_shared()
+            if self._value and time.time() < self._expires_at:
+                return self._value
+            if time.time() > deadline:
+                logger.warning(f"Timed out waiting for the {self.name} token refresh, fetching directly")
+                return self._fetch()
+            time.sleep(0.2)
+
+    @property
+    def expires_in(self):
+        return max(int(self._expires_at - time.time()), 0)
+
+    def invalidate(self):
+        self._value = None
+        self._expires_at = 0
+        self._refresh_at = 0
+        cache.delete(self.cache_key)
+
+    def _load_shared(self):
+        shared = cache.get(self.cache_key)
+        if shared and shared["expires_at"] > self._expires_at:
+            self._value = shared["value"]
+            self._expires_at = shared["expires_at"]
+            self._refresh_at = shared["refresh_at"]
+
+    def _fetch(self):
+        value, expires_in = self.fetch()
+        expires_in = int(expires_in)
+        self._value = value
+        self._expires_at = time.time() + expires_in
+        # short-lived tokens are refreshed halfway through their lifetime
+        self._refresh_at = self._expires_at - min(self.refresh_margin, expires_in / 2)
+        cache.set(
+            self.cache_key,
+            {"value": value, "expires_at": self._expires_at, "refresh_at": self._refresh_at},
+            expires_in,
+        )
+        return value
+
+
+# Credential store for the carrier integrations: register a fetch function
+# once, then call get_token(name) from any crawler.
+_tokens = {}
+
+
+def register_token(name, fetch, **options):
+    _tokens[name] = CachedToken(name, fetch, **options)
+    return _tokens[name]
+
+
+def carrier_token(name, **options):
+    def decorator(fetch):
+        register_token(name, fetch, **options)
+        return fetch
+
+    return decorator
+
+
+def get_credential(name):
+    return _tokens[name]
+
+
+def get_token(name):
+    return _tokens[name].get()
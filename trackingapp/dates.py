@@ -0,0 +1,211 @@
+import logging
+import re
+from datetime import datetime
+
+import dateutil.parser as parser
+
+logger = logging.getLogger(__name__)
+
+# Carrier timestamp normalisation with a per-field format cache.
+#
+# Each carrier field sends its timestamps in one layout, so after the first
+# successful parse the matching strptime format is remembered under the
+# field's key (e.g. "uprr.eta") and later values go straight to strptime.
+# dateutil is only used when no known format matches. A format is learned
+# only if it gives the same datetime dateutil does, so results never differ
+# from the plain parser.parse path. Values parsed without a key go straight
+# to dateutil.
+
+DB2_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# month-first only, matching dateutil's default (dayfirst=False); no %y,
+# whose century pivot differs from dateutil's
+KNOWN_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %I:%M:%S %p",
+    "%m/%d/%Y %I:%M %p",
+    "%m/%d/%Y",
+    "%d-%b-%Y %H:%M:%S",
+    "%d-%b-%Y %H:%M",
+    "%d-%b-%Y",
+    "%b %d, %Y %I:%M %p",
+    "%b %d, %Y",
+    "%Y%m%d%H%M%S",
+)
+
+MONTHS = {month: number for number, month in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1
+)}
+DIRECTIVES = {
+    "%Y": r"(?P<year>\d{4})",
+    "%m": r"(?P<month>\d{1,2})",
+    "%d": r"(?P<day>\d{1,2})",
+    "%H": r"(?P<hour>\d{1,2})",
+    "%I": r"(?P<hour12>\d{1,2})",
+    "%M": r"(?P<minute>\d{1,2})",
+    "%S": r"(?P<second>\d{1,2})",
+    "%p": r"(?P<ampm>[AaPp][Mm])",
+    "%b": r"(?P<month_name>[A-Za-z]{3})",
+}
+# layouts without separators ("%Y%m%d%H%M%S") need fixed-width fields, or a
+# shorter value would be split differently than dateutil splits it
+FIXED_WIDTH = {
+    "%m": r"(?P<month>\d{2})",
+    "%d": r"(?P<day>\d{2})",
+    "%H": r"(?P<hour>\d{2})",
+    "%I": r"(?P<hour12>\d{2})",
+    "%M": r"(?P<minute>\d{2})",
+    "%S": r"(?P<second>\d{2})",
+}
+ISO_FORMATS = {"%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S.%f"}
+
+# formats remembered per key, so a field that alternates between a few
+# layouts does not relearn on every switch
+RECENT_FORMATS = 3
+
+# key -> strptime formats, most recently matched first
+_formats = {}
+# strptime format -> parser
+_parsers = {}
+stats = {"hits": 0, "learned": 0, "fallbacks": 0, "failures": 0}
+
+
+def learn_format(value, parsed):
+    for date_format in KNOWN_FORMATS:
+        try:
+            # the compiled parser has to agree with dateutil, not just strptime
+            if datetime.strptime(value, date_format) == parsed == get_parser(date_format)(value):
+                return date_format
+        except ValueError:
+            continue
+    return None
+
+
+# a regex equivalent of strptime for the numeric layouts carriers use;
+# strptime for anything else (%z, %f, ...)
+def compile_format(date_format):
+    if date_format in ISO_FORMATS:
+        return datetime.fromisoformat
+    parts = re.split(r"(%.)", date_format)
+    if any(part.startswith("%") and part not in DIRECTIVES for part in parts):
+        return lambda value: datetime.strptime(value, date_format)
+    directives = {**DIRECTIVES, **FIXED_WIDTH} if re.search(r"%.%.", date_format) else DIRECTIVES
+    pattern = re.compile("".join(
+        directives[part] if part.startswith("%") else r"\s+".join(map(re.escape, part.split(" ")))
+        for part in parts
+    ) + r"\Z")
+
+    def parse(value):
+        match = pattern.match(value)
+        if match is None:
+            raise ValueError(f"{value!r} does not match {date_format!r}")
+        fields = match.groupdict()
+        if "month_name" in fields:
+            month = MONTHS.get(fields["month_name"].lower())
+            if month is None:
+                raise ValueError(f"Unknown month in {value!r}")
+        else:
+            month = int(fields["month"])
+        if "hour12" in fields:
+            hour = int(fields["hour12"])
+            if not 1 <= hour <= 12:
+                raise ValueError(f"Hour out of range in {value!r}")
+            hour = hour % 12 + (12 if fields.get("ampm", "am").lower() == "pm" else 0)
+        else:
+            hour = int(fields.get("hour") or 0)
+        return datetime(
+            int(fields["year"]), month, int(fields["day"]),
+            hour, int(fields.get("minute") or 0), int(fields.get("second") or 0),
+        )
+    return parse
+
+
+def get_parser(date_format):
+    parse = _parsers.get(date_format)
+    if parse is None:
+        parse = _parsers[date_format] = compile_format(date_format)
+    return parse
+
+
+def parse_date(value, key=None):
+    if value is None or isinstance(value, datetime):
+        return value
+    value = value.strip()
+    if not value:
+        return None
+    if key is None:
+        # callers without a field key mix layouts; learning would thrash
+        try:
+            return parser.parse(value)
+        except (ValueError, OverflowError):
+            stats["failures"] += 1
+            return None
+    date_formats = _formats.get(key, ())
+    for position, date_format in enumerate(date_formats):
+        try:
+            parsed = get_parser(date_format)(value)
+        except ValueError:
+            continue
+        stats["hits"] += 1
+        if position:
+            # most recently matched first
+            _formats[key] = [date_format] + [f for f in date_formats if f != date_format]
+        return parsed
+    try:
+        parsed = parser.parse(value)
+    except (ValueError, OverflowError):
+        stats["failures"] += 1
+        return None
+    stats["fallbacks"] += 1
+    date_format = learn_format(value, parsed)
+    if date_format is not None:
+        _formats[key] = [date_format] + list(date_formats[:RECENT_FORMATS - 1])
+        stats["learned"] += 1
+    return parsed
+
+
+def normalize_date(value, key=None, date_format=DB2_FORMAT, default=None):
+    parsed = parse_date(value, key)
+    if parsed is None:
+        return default
+    return parsed.strftime(date_format)
+
+
+# converts a whole column; the field's parser is looked up once and only
+# values it cannot read take the per-value path
+def normalize_dates(values, key=None, date_format=DB2_FORMAT, default=None):
+    results = []
+    parse = None
+    hits = 0
+    for value in values:
+        if parse is None and _formats.get(key):
+            parse = get_parser(_formats[key][0])
+        if parse is not None and isinstance(value, str):
+            try:
+                results.append(parse(value.strip()).strftime(date_format))
+                hits += 1
+                continue
+            except ValueError:
+                pass
+        results.append(normalize_date(value, key, date_format, default))
+        # the miss may have changed the field's leading format
+        parse = None
+    stats["hits"] += hits
+    return results
+
+
+def learned_formats():
+    return {key: list(date_formats) for key, date_formats in _formats.items()}
+
+
+def forget_formats():
+    _formats.clear()
@@ -0,0 +1,100 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection
+
+from tracking import recorder
+from tracking.models import TraceReportLog
+
+logger = logging.getLogger(__name__)
+
+# Concurrent execution for crawlers that split their work into batches.
+#
+# A crawler opts in by defining
+#
+#   get_batches()       -> iterable of container batches; each batch must be
+#                          JSON-serialisable (lists/dicts of str, int, ...)
+#                          because chunked runs store them in
+#                          CrawlerRunChunk.batches, see tracking.checkpoints
+#   trace_batch(batch)  -> (units_traced, success) for that batch
+#
+# trace_batch runs on pool threads; rows it hands to tracking.recorder.record
+# go into the run's shared write-behind buffer.
+#
+# run_crawler then fans the batches out over a thread pool, keeping at most
+# ``concurrency`` lookups in flight, and writes one TraceReportLog with the
+# totals. Concurrency per crawler comes from tracking_CRAWLER_CONCURRENCY,
+# e.g. {"default": 4, "uprr_imports": 8, "gpa_imports": 1}.
+
+DEFAULT_CONCURRENCY = 4
+
+
+def supports_batches(crawler_instance):
+    return callable(getattr(crawler_instance, "get_batches", None)) and callable(
+        getattr(crawler_instance, "trace_batch", None)
+    )
+
+
+def get_concurrency(crawler):
+    configured = getattr(settings, "tracking_CRAWLER_CONCURRENCY", {})
+    return max(1, int(configured.get(crawler, configured.get("default", DEFAULT_CONCURRENCY))))
+
+
+def call_in_thread(func, item):
+    try:
+        return func(item)
+    finally:
+        # worker threads get their own DB connection; don't leak it
+        connection.close()
+
+
+def collect(done, pending):
+    for future in done:
+        item = pending.pop(future)
+        exception = future.exception()
+        yield item, None if exception else future.result(), exception
+
+
+# yields (item, result, exception) in completion order while never having
+# more than ``max_in_flight`` calls submitted at once
+def run_bounded(func, items, max_workers, max_in_flight=None):
+    max_in_flight = max_in_flight or max_workers
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crawler") as executor:
+        pending = {}
+        for item in items:
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from collect(done, pending)
+            pending[executor.submit(call_in_thread, func, item)] = item
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from collect(done, pending)
+
+
+def run_batches(crawler, crawler_instance, batches=None):
+    concurrency = get_concurrency(crawler)
+    batches = crawler_instance.get_batches() if batches is None else batches
+    units_traced = success = failed_batches = 0
+    for batch, result, exception in run_bounded(crawler_instance.trace_batch, batches, concurrency):
+        if exception is not None:
+            failed_batches += 1
+            logger.error(f"{crawler}: batch failed: {exception!r}")
+            continue
+        units_traced += result[0]
+        success += result[1]
+    return units_traced, success, failed_batches
+
+
+def run_concurrent(crawler, crawler_instance):
+    units_traced, success, failed_batches = run_batches(crawler, crawler_instance)
+    recorder.record(TraceReportLog(
+        website=crawler_instance.website,
+        units_traced=units_traced,
+        success=success,
+    ))
+    logger.info(
+        f"{crawler}: traced {units_traced} units, {success} succeeded, {failed_batches} batches failed "
+        f"(concurrency {get_concurrency(crawler)})"
+    )
+    return units_traced, success
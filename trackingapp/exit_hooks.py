@@ -0,0 +1,19 @@
+import atexit
+
+from celery.signals import worker_process_shutdown
+
+_hooks = []
+
+
+# registers ``func`` to run when the process exits. atexit alone is not
+# enough: prefork worker children leave through os._exit, which skips it
+def on_process_exit(func):
+    atexit.register(func)
+    _hooks.append(func)
+    return func
+
+
+@worker_process_shutdown.connect
+def run_exit_hooks(**kwargs):
+    for func in _hooks:
+        func()
@@ -1,17 +1,24 @@
-import dateutil.parser as parser
 from datetime import datetime, time, date
-from strict_hint import strict
+from django.conf import settings
+from tracking.dates import DB2_FORMAT, normalize_date, parse_date
 import logging
-import xlwt
-import os
 import json
-from xhtml2pdf import pisa
-from django.conf import settings
-import socket
-from django.template.loader import get_template
 
 logger = logging.getLogger(__name__)
 
+# strict_hint checks every call of the helpers below, which crawlers make
+# millions of times a day. It is applied here, once, only when
+# tracking_STRICT_HELPERS is on; otherwise the helpers are the plain
+# functions. It defaults to DEBUG; the Django test runner forces DEBUG off,
+# so test settings should set tracking_STRICT_HELPERS = True.
+STRICT_HELPERS = getattr(settings, "tracking_STRICT_HELPERS", settings.DEBUG)
+
+if STRICT_HELPERS:
+    from strict_hint import strict
+else:
+    def strict(func):
+        return func
+
 
 # case insensitive string comparison
 @strict
@@ -22,12 +29,39 @@ def stri_compare(str1, str2) -> bool:
         return str1 == str2
 
 
+# stri_compare of every value against one other value
 @strict
-def convert_string_into_db2_format(string) -> str:
+def stri_compare_many(values, other) -> list:
+    if not isinstance(other, str):
+        return [value == other for value in values]
+    other_key = other.upper().strip()
+    return [
+        value.upper().strip() == other_key if isinstance(value, str) else value == other
+        for value in values
+    ]
+
+
+# stri_compare of two columns, pairwise
+@strict
+def stri_compare_pairs(values, others) -> list:
+    return [
+        str1.upper().strip() == str2.upper().strip()
+        if isinstance(str1, str) and isinstance(str2, str) else str1 == str2
+        for str1, str2 in zip(values, others)
+    ]
+
+
+# key names the carrier field (e.g. "uprr.eta") so its format is learned
+# once, see tracking.dates
+@strict
+def convert_string_into_db2_format(string, key=None) -> str:
     if string is None or string == "":
         return ""
     try:
-        return parser.parse(string).strftime("%Y-%m-%d %H:%M:%S")
+        converted = normalize_date(string, key, DB2_FORMAT)
+        if converted is not None:
+            return converted
+        logger.info(f"Error while trying to convert string {string} into db2 format, unknown date format")
     except Exception as ex:
         logger.info(
             f"Error while trying to convert string {string} into db2 format, {ex}"
@@ -40,11 +74,16 @@ def format_date(
         date_time,
         date_format="%m/%d/%Y",
         return_value="",
+        key=None,
 ) -> str:
     formatted_date = return_value
     try:
         if isinstance(date_time, str):
-            formatted_date = parser.parse(date_time).strftime(date_format)
+            parsed = parse_date(date_time, key)
+            if parsed is None:
+                logger.info(f"formatted date exception {date_time}, unknown date format")
+            else:
+                formatted_date = parsed.strftime(date_format)
         else:
             formatted_date = date_time.strftime(date_format)
     except Exception as ex:
@@ -61,6 +100,11 @@ def is_null_or_empty(val) -> bool:
     return False
 
 
+@strict
+def is_null_or_empty_many(values) -> list:
+    return [val is None or val.strip() == "" for val in values]
+
+
 def calculate_seconds(start_time: str, end_time: str):
     start_hour, start_min = start_time.split(':')
     end_hour, end_min = end_time.split(':')
@@ -91,87 +135,6 @@ def get_cron_end_time(cron):
     return time(int(hour), int(minute))
 
 
-def generate_excel_report(response, report_type="unittraces", to="", _from=""):
-    columns = [
-        "Name",
-        "Website",
-        "Website Status",
-        "Last Traced",
-        "Units Traced",
-        "Successes",
-        "Failures",
-    ]
-    # add custom color for header
-    xlwt.add_palette_colour("header_color", 0x21)
-    # Create a workbook and add a worksheet.
-    workbook = xlwt.Workbook()
-    # set custom header color
-    workbook.set_colour_RGB(0x21, 226, 222, 208)
-    if report_type == "unittraces":
-        worksheet = workbook.add_sheet("UnitTraces Report")
-    else:
-        worksheet = workbook.add_sheet("WebCrawlers Report")
-    # freeze first row
-    worksheet.set_panes_frozen(True)
-    worksheet.set_horz_split_pos(1)
-    worksheet.set_vert_split_pos(1)
-    # set font size to 12
-    style = xlwt.easyxf(f"pattern: pattern solid,fore_colour white;font: name Calibri, height {12 * 20};")
-    if report_type == "unittraces":
-        header_column = f"UnitTraces Report: {_from} - {to}"
-    else:
-        header_column = f"WebCrawlers Report: {_from} - {to}"
-    worksheet.write_merge(0, 0, 0, 5, header_column, style)
-    # set font size to 12
-    style = xlwt.easyxf(
-        f"pattern: pattern solid, fore_colour header_color;font: name Calibri, bold True, height {12 * 20};"
-    )
-    for column_index, column in enumerate(columns):
-        worksheet.col(column_index).width = 256 * (len(column) + 4)
-        worksheet.write(2, column_index, column, style)
-
-    # Start from the first cell below the headers.
-    row = 3
-    col = 0
-    # set font size to 12
-    style = xlwt.easyxf(f"font:color-index black, name Calibri, height {12 * 20}")
-
-    for item in response:
-        worksheet.write(row, col, "Imports", style)
-        worksheet.write(row, col + 1, f"{item['name']}", style)
-        worksheet.write(row, col + 2, f"{item['status']}", style)
-        worksheet.write(row, col + 3, f"{item['created_at']}", style)
-        worksheet.write(row, col + 4, f"{item['units_traced']}", style)
-        worksheet.write(row, col + 5, f"{item['success']}", style)
-        worksheet.write(row, col + 6, f"{item['units_traced'] - item['success']}", style)
-        row += 1
-    if report_type == "unittraces":
-        filename = f"UnitTracesReport_{datetime.timestamp(datetime.now())}.xls"
-    else:
-        filename = f"WebCrawlersReport_{datetime.timestamp(datetime.now())}.xls"
-
-    download_folder = settings.tracking_DOWNLOADS_DIR
-    workbook.save(f"{os.path.join(download_folder, filename)}")
-    return os.path.join(download_folder, filename)
-
-
-def generate_pdf_report(items, report_name, start_date, end_date):
-    filename = report_name.replace(' ', '') + f"_{datetime.timestamp(datetime.now())}.pdf"
-    template = get_template("public/pdf_reports.html")
-    html = template.render(
-        context={
-            "items": items,
-            "url": f"https://{socket.gethostname()}{settings.STATIC_URL}images/client_logo.png",
-            "report_name": f"{report_name}: {start_date} - {end_date}",
-        }
-    )
-
-    file = open(os.path.join(settings.tracking_DOWNLOADS_DIR, filename), "w+b")
-    pisa_status = pisa.CreatePDF(html, dest=file)
-    file.close()
-    return os.path.join(settings.tracking_DOWNLOADS_DIR, filename)
-
-
 def get_gpa_current_status(available, location):
     if available.upper() == 'YES':
         return 'RELEASED'
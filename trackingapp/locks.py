@@ -0,0 +1,112 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Single-flight lock per crawler name, held in the shared Django cache.
+#
+# The holder refreshes the entry every ``heartbeat_interval`` seconds. The
+# entry's timeout is ``stale_after``, so a worker that dies (or is killed at
+# the hard time limit) stops heartbeating and its lock simply expires; the
+# next run takes over without manual cleanup.
+
+HEARTBEAT_INTERVAL = getattr(settings, "tracking_CRAWLER_LOCK_HEARTBEAT", 30)
+STALE_AFTER = getattr(settings, "tracking_CRAWLER_LOCK_STALE_AFTER", 120)
+# how long a queued-but-not-started run blocks duplicate enqueues
+QUEUED_TIMEOUT = getattr(settings, "tracking_CRAWLER_QUEUED_TIMEOUT", 300)
+
+
+def run_key(name):
+    return f"tracking:crawler-run:{name}"
+
+
+def queued_key(name):
+    return f"tracking:crawler-queued:{name}"
+
+
+class CrawlerRunLock:
+    def __init__(self, name, heartbeat_interval=HEARTBEAT_INTERVAL, stale_after=STALE_AFTER):
+        self.name = name
+        self.key = run_key(name)
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.owner = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        now = time.time()
+        payload = {
+            "owner": self.owner,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started_at": now,
+            "heartbeat_at": now,
+        }
+        if not cache.add(self.key, payload, self.stale_after):
+            return False
+        self.payload = payload
+        self._thread = threading.Thread(target=self._heartbeat, name=f"lock-{self.name}", daemon=True)
+        self._thread.start()
+        return True
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        current = cache.get(self.key)
+        if current and current["owner"] == self.owner:
+            cache.delete(self.key)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            current = cache.get(self.key)
+            if current and current["owner"] != self.owner:
+                logger.warning(f"{self.name}: run lock was taken over by another worker")
+                return
+            self.payload["heartbeat_at"] = time.time()
+            cache.set(self.key, self.payload, self.stale_after)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self.release()
+
+
+def chunked_key(name):
+    return f"tracking:crawler-chunked:{name}"
+
+
+# a checkpointed run keeps the crawler marked as running while its chunks
+# are queued or running; every chunk task refreshes the mark and it is
+# cleared once the run is settled
+def mark_chunked_run(name, run_id, timeout):
+    cache.set(chunked_key(name), {"run_id": run_id, "heartbeat_at": time.time()}, timeout)
+
+
+def clear_chunked_run(name):
+    cache.delete(chunked_key(name))
+
+
+def get_running(name):
+    return cache.get(run_key(name)) or cache.get(chunked_key(name))
+
+
+# marks a run as queued; False when one is already queued or running
+def mark_queued(name):
+    if get_running(name):
+        return False
+    return cache.add(queued_key(name), time.time(), QUEUED_TIMEOUT)
+
+
+def clear_queued(name):
+    cache.delete(queued_key(name))
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+# Base for the rollup backfill commands: parses --from/--to (the oldest
+# source row and today by default) and calls backfill() for each window of
+# --days-per-batch days. Each window is its own transaction, which keeps
+# locks short on large tables.
+class BackfillCommand(BaseCommand):
+    # what is rolled up, for --help and the empty-table message
+    source_name = "rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from", dest="from_date", help=f"YYYY-MM-DD, defaults to the oldest of the {self.source_name}"
+        )
+        parser.add_argument("--to", dest="to_date", help="YYYY-MM-DD inclusive, defaults to today")
+        parser.add_argument("--days-per-batch", type=int, default=31)
+
+    # the source rows; their oldest created_at is the default --from
+    def get_queryset(self):
+        raise NotImplementedError
+
+    # rolls up the days first_day..last_day and returns a line of output
+    def backfill(self, first_day, last_day):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        try:
+            if options["from_date"]:
+                start = datetime.strptime(options["from_date"], "%Y-%m-%d").date()
+            else:
+                oldest = self.get_queryset().order_by("created_at").values_list("created_at", flat=True).first()
+                if oldest is None:
+                    self.stdout.write(f"No {self.source_name} to roll up")
+                    return
+                start = timezone.localtime(oldest).date() if timezone.is_aware(oldest) else oldest.date()
+            if options["to_date"]:
+                end = datetime.strptime(options["to_date"], "%Y-%m-%d").date()
+            else:
+                end = timezone.localdate()
+        except ValueError as ex:
+            raise CommandError(ex)
+
+        step = timedelta(days=options["days_per_batch"])
+        first_day = start
+        while first_day <= end:
+            last_day = min(first_day + step - timedelta(days=1), end)
+            self.stdout.write(f"{first_day} - {last_day}: {self.backfill(first_day, last_day)}")
+            first_day = last_day + timedelta(days=1)
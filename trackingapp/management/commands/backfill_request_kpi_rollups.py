@@ -0,0 +1,14 @@
+from tracking.management.backfill import BackfillCommand
+from tracking.models import RequestKPI
+from tracking.rollups import rollup_request_kpis
+
+
+class Command(BackfillCommand):
+    help = "Rebuild RequestKPIRollup rows from raw RequestKPI rows"
+    source_name = "request KPIs"
+
+    def get_queryset(self):
+        return RequestKPI.objects.all()
+
+    def backfill(self, first_day, last_day):
+        return f"{rollup_request_kpis(first_day, last_day)} website days"
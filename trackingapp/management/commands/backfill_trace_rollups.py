@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from tracking.management.backfill import BackfillCommand
+from tracking.models import TraceReportLog
+from tracking.rollups import DAY, backfill_trace_rollups, day_start
+
+
+class Command(BackfillCommand):
+    help = "Rebuild TraceReportRollup rows from raw TraceReportLog rows"
+    source_name = "trace logs"
+
+    def get_queryset(self):
+        return TraceReportLog.objects.all()
+
+    def backfill(self, first_day, last_day):
+        created = backfill_trace_rollups(DAY, day_start(first_day), day_start(last_day + timedelta(days=1)))
+        return f"{created} buckets"
@@ -0,0 +1,298 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+
+from tracking.exit_hooks import on_process_exit
+
+logger = logging.getLogger(__name__)
+
+# Error notification digests. Errors are counted per website in fixed
+# windows of tracking_ERROR_DIGEST_WINDOW seconds; once a window has closed
+# the website gets one email with the error count and its most frequent
+# messages. All digests that are due go out over a single SMTP connection.
+#
+#   tracking_ERROR_DIGEST_WINDOW = 300   # seconds; 0 sends every error at once
+#   tracking_ERROR_DIGEST_TOP = 10       # distinct messages listed per digest
+#   tracking_ERROR_DIGEST_STORE = "tracking.notifications.DatabaseDigestStore"
+#
+# Each process counts its errors in memory and publishes them to the store
+# every few seconds; closed windows are sent by the process that finds them,
+# and by the flush_error_digests beat task for windows no live process is
+# left to send. The database store is shared by every worker, and a
+# closed window is claimed by exactly one sender, so N prefork children
+# still produce one digest per website and window. LocalDigestStore only
+# aggregates within one process.
+
+WINDOW = getattr(settings, "tracking_ERROR_DIGEST_WINDOW", 300)
+TOP_N = getattr(settings, "tracking_ERROR_DIGEST_TOP", 10)
+# seconds between publishing local counts; closed windows wait this long
+# twice over so late publishers still make it into the digest
+PUBLISH_INTERVAL = 5
+KEEP_DAYS = 7
+FROM_EMAIL = "dun.system.messages@client.com"
+RECIPIENTS_KEY = "tracking:error-recipients"
+
+
+class ErrorDigestMessage(models.Model):
+    website_name = models.CharField(max_length=100)
+    window_start = models.DateTimeField()
+    message_hash = models.CharField(max_length=32)
+    message = models.TextField()
+    count = models.IntegerField(default=0)
+    sent = models.BooleanField(default=False)
+
+    class Meta:
+        app_label = "tracking"
+        unique_together = ("website_name", "window_start", "message_hash")
+        indexes = [models.Index(fields=["sent", "window_start"])]
+
+    def __str__(self):
+        return f"{self.website_name} {self.window_start} x{self.count}"
+
+
+def get_error_recipients():
+    # tracking.models imports this module to register ErrorDigestMessage
+    from tracking.models import Notification
+
+    recipients = cache.get(RECIPIENTS_KEY)
+    if recipients is None:
+        emails = (
+            Notification.objects.filter(name="bcc_mail")
+            .values_list("email_list", flat=True)
+            .first()
+        )
+        recipients = [email.strip() for email in (emails or "").split(",") if email.strip()]
+        cache.set(RECIPIENTS_KEY, recipients, None)
+    return recipients
+
+
+def invalidate_error_recipients():
+    cache.delete(RECIPIENTS_KEY)
+
+
+class WebsiteErrors:
+    def __init__(self):
+        self.count = 0
+        self.messages = Counter()
+
+    def add(self, message, count=1):
+        self.count += count
+        self.messages[message] += count
+
+
+def window_start(now, window):
+    start = datetime.fromtimestamp(now - now % window, tz=dt_timezone.utc)
+    return start if settings.USE_TZ else timezone.make_naive(start)
+
+
+def message_hash(message):
+    return hashlib.md5(message.encode()).hexdigest()
+
+
+# Stores take the per-process counts and hand out closed windows. claim_due
+# is a context manager; the claimed windows only count as sent when the
+# block exits without an error.
+class DatabaseDigestStore:
+    def publish(self, pending):
+        for (website_name, start), errors in pending.items():
+            for message, count in errors.messages.items():
+                row, _ = ErrorDigestMessage.objects.get_or_create(
+                    website_name=website_name,
+                    window_start=start,
+                    message_hash=message_hash(message),
+                    defaults={"message": message},
+                )
+                ErrorDigestMessage.objects.filter(pk=row.pk).update(count=models.F("count") + count)
+
+    @contextmanager
+    def claim_due(self, closed_before):
+        with transaction.atomic():
+            # skip_locked: another worker sending the same windows keeps them
+            rows = list(
+                ErrorDigestMessage.objects.select_for_update(skip_locked=True)
+                .filter(sent=False, window_start__lt=closed_before)
+                .order_by("website_name", "window_start")
+            )
+            due = {}
+            for row in rows:
+                due.setdefault(row.website_name, WebsiteErrors()).add(row.message, row.count)
+            yield due
+            ErrorDigestMessage.objects.filter(pk__in=[row.pk for row in rows]).update(sent=True)
+        ErrorDigestMessage.objects.filter(
+            sent=True, window_start__lt=timezone.now() - timedelta(days=KEEP_DAYS)
+        ).delete()
+
+
+class LocalDigestStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.windows = {}
+
+    def publish(self, pending):
+        with self.lock:
+            for key, errors in pending.items():
+                stored = self.windows.setdefault(key, WebsiteErrors())
+                for message, count in errors.messages.items():
+                    stored.add(message, count)
+
+    @contextmanager
+    def claim_due(self, closed_before):
+        with self.lock:
+            keys = [key for key in self.windows if key[1] < closed_before]
+            due = {}
+            for key in keys:
+                for message, count in self.windows[key].messages.items():
+                    due.setdefault(key[0], WebsiteErrors()).add(message, count)
+            yield due
+            for key in keys:
+                del self.windows[key]
+
+
+def get_store():
+    path = getattr(settings, "tracking_ERROR_DIGEST_STORE", "tracking.notifications.DatabaseDigestStore")
+    return import_string(path)()
+
+
+def build_digest(website_name, errors, recipients, window, top=TOP_N):
+    if errors.count == 1:
+        # a lone error goes out as before
+        html = next(iter(errors.messages))
+    else:
+        common = errors.messages.most_common(top)
+        others = len(errors.messages) - len(common)
+        minutes = max(1, round(window / 60))
+        items = "".join(f"<li><b>{count} &times;</b> {message}</li>" for message, count in common)
+        html = (
+            f"<p>{errors.count} trace errors for {website_name} in the last {minutes} min, "
+            f"{len(errors.messages)} distinct.</p><ol>{items}</ol>"
+        )
+        if others:
+            html += f"<p>and {others} more distinct errors</p>"
+    subject = f"[tracking] Trace Error Notification - {website_name}"
+    if errors.count > 1:
+        subject += f" ({errors.count} errors)"
+    email = EmailMultiAlternatives(subject, strip_tags(html), FROM_EMAIL, recipients)
+    email.attach_alternative(html, "text/html")
+    return email
+
+
+class ErrorDigest:
+    def __init__(
+        self,
+        window=WINDOW,
+        top=TOP_N,
+        connection_factory=get_connection,
+        get_recipients=get_error_recipients,
+        store=None,
+    ):
+        self.window = window
+        self.top = top
+        self.connection_factory = connection_factory
+        self.get_recipients = get_recipients
+        self.store = store or get_store()
+        # (website name, window start) -> errors not yet published
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.published_at = 0
+        self._thread = None
+
+    def add(self, website_name, message):
+        with self.lock:
+            key = (website_name, window_start(time.time(), self.window))
+            self.pending.setdefault(key, WebsiteErrors()).add(message)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="error-digest", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(PUBLISH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Sending error digests failed")
+            finally:
+                connection.close()
+            # keep going until the windows this process published to have
+            # closed and been sent, by this or another worker
+            with self.lock:
+                idle = time.time() - self.published_at > self.window + 3 * PUBLISH_INTERVAL
+                if not self.pending and idle:
+                    self._thread = None
+                    return
+
+    def publish(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if pending:
+            self.store.publish(pending)
+            self.published_at = time.time()
+
+    # publishes this process's counts, then sends every window that has
+    # closed (with force, including the current ones)
+    def flush(self, force=False):
+        self.publish()
+        if force:
+            closed_before = window_start(time.time() + self.window, self.window)
+        else:
+            closed_before = window_start(time.time() - 2 * PUBLISH_INTERVAL, self.window)
+        with self.store.claim_due(closed_before) as due:
+            if not due:
+                return 0
+            recipients = self.get_recipients()
+            if not recipients:
+                logger.warning(f"No bcc_mail recipients, dropping error digests for {', '.join(due)}")
+                return 0
+            messages = [
+                build_digest(website_name, errors, recipients, self.window, self.top)
+                for website_name, errors in due.items()
+            ]
+            sent = self.connection_factory().send_messages(messages) or 0
+        self.sent += sent
+        return sent
+
+
+_digest = None
+_digest_lock = threading.Lock()
+
+
+def get_digest():
+    global _digest
+    if _digest is None:
+        with _digest_lock:
+            if _digest is None:
+                _digest = ErrorDigest()
+    return _digest
+
+
+# on the way out only this process's counts are published; the windows
+# are sent by whichever worker finds them closed
+@on_process_exit
+def flush_errors():
+    if _digest is not None:
+        _digest.publish()
+
+
+def notify_error(website_name, html):
+    if not WINDOW:
+        recipients = get_error_recipients()
+        if recipients:
+            errors = WebsiteErrors()
+            errors.add(html)
+            build_digest(website_name, errors, recipients, WINDOW).send()
+        return
+    get_digest().add(website_name, html)
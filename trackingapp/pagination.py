@@ -0,0 +1,63 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# opaque cursor for keyset pagination on (created_at, id)
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError) as ex:
+        raise InvalidCursor(f"Invalid cursor {cursor!r}") from ex
+
+
+def get_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return default
+
+
+# returns one page of ``queryset`` (a .values() queryset that includes
+# created_at and id) after ``cursor``, plus the cursor of the next page
+def keyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE, descending=True):
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        if descending:
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        else:
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+    if descending:
+        queryset = queryset.order_by("-created_at", "-id")
+    else:
+        queryset = queryset.order_by("created_at", "id")
+    rows = list(queryset[: page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+# the rows at or before ``cursor`` that are at most ``overlap`` older than
+# it, oldest first; see views.get_trace_changes
+def keyset_overlap(queryset, cursor, overlap, limit=MAX_PAGE_SIZE):
+    created_at, pk = decode_cursor(cursor)
+    queryset = queryset.filter(created_at__gte=created_at - overlap).filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=pk)
+    )
+    return list(queryset.order_by("created_at", "id")[:limit])
@@ -0,0 +1,192 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils.module_loading import import_string
+
+# Per-carrier token bucket plus concurrency slots, shared by every worker.
+#
+#   tracking_CARRIER_RATE_LIMITS = {
+#       # requests per second, bucket size, concurrent requests
+#       "csx": {"rate": 5, "burst": 10, "concurrency": 4},
+#   }
+#   tracking_RATE_LIMIT_BACKEND = "tracking.ratelimit.DatabaseBackend"
+#
+# Carriers without an entry are not limited. The database backend keeps the
+# state in CarrierRateLimit/CarrierSlot rows so limits hold across workers;
+# LocalBackend only limits within one process.
+
+SLOT_LEASE = 300
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class CarrierRateLimit(models.Model):
+    carrier = models.CharField(max_length=50, unique=True)
+    tokens = models.FloatField(default=0)
+    # epoch seconds of the last refill
+    refilled_at = models.FloatField(default=0)
+
+    class Meta:
+        app_label = "tracking"
+
+    def __str__(self):
+        return self.carrier
+
+
+class CarrierSlot(models.Model):
+    carrier = models.CharField(max_length=50, db_index=True)
+    slot_id = models.CharField(max_length=32, unique=True)
+    # epoch seconds; a crashed worker's slot frees itself after the lease
+    expires_at = models.FloatField()
+
+    class Meta:
+        app_label = "tracking"
+
+    def __str__(self):
+        return f"{self.carrier} {self.slot_id}"
+
+
+def refill(tokens, refilled_at, rate, burst, now):
+    return min(burst, tokens + (now - refilled_at) * rate)
+
+
+# Backends return 0 when the token / slot was granted, otherwise the number
+# of seconds to wait before trying again.
+class DatabaseBackend:
+    def take_token(self, carrier, rate, burst):
+        now = time.time()
+        with transaction.atomic():
+            bucket, created = CarrierRateLimit.objects.select_for_update().get_or_create(
+                carrier=carrier, defaults={"tokens": burst, "refilled_at": now}
+            )
+            tokens = refill(bucket.tokens, bucket.refilled_at, rate, burst, now)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            bucket.tokens, bucket.refilled_at = tokens, now
+            bucket.save(update_fields=["tokens", "refilled_at"])
+        return wait
+
+    def take_slot(self, carrier, concurrency, slot_id):
+        now = time.time()
+        with transaction.atomic():
+            # the bucket row doubles as the per-carrier lock for slot counting;
+            # refilled_at=0 makes the first take_token refill it to burst
+            CarrierRateLimit.objects.select_for_update().get_or_create(
+                carrier=carrier, defaults={"refilled_at": 0}
+            )
+            CarrierSlot.objects.filter(carrier=carrier, expires_at__lt=now).delete()
+            if CarrierSlot.objects.filter(carrier=carrier).count() >= concurrency:
+                return 0.1
+            CarrierSlot.objects.create(carrier=carrier, slot_id=slot_id, expires_at=now + SLOT_LEASE)
+        return 0
+
+    def release_slot(self, carrier, slot_id):
+        CarrierSlot.objects.filter(slot_id=slot_id).delete()
+
+
+class LocalBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.slots = {}
+
+    def take_token(self, carrier, rate, burst):
+        now = time.time()
+        with self.lock:
+            tokens, refilled_at = self.buckets.get(carrier, (burst, now))
+            tokens = refill(tokens, refilled_at, rate, burst, now)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self.buckets[carrier] = (tokens, now)
+        return wait
+
+    def take_slot(self, carrier, concurrency, slot_id):
+        with self.lock:
+            slots = self.slots.setdefault(carrier, set())
+            if len(slots) >= concurrency:
+                return 0.05
+            slots.add(slot_id)
+        return 0
+
+    def release_slot(self, carrier, slot_id):
+        with self.lock:
+            self.slots.get(carrier, set()).discard(slot_id)
+
+
+class CarrierLimiter:
+    def __init__(self, carrier, backend, rate=None, burst=None, concurrency=None):
+        self.carrier = carrier
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst or max(1, rate or 1)
+        self.concurrency = concurrency
+
+    def acquire_token(self, deadline):
+        if not self.rate:
+            return
+        while wait := self.backend.take_token(self.carrier, self.rate, self.burst):
+            sleep_until(wait, deadline, self.carrier)
+
+    @contextmanager
+    def slot(self, deadline):
+        if not self.concurrency:
+            yield
+            return
+        slot_id = uuid.uuid4().hex
+        while wait := self.backend.take_slot(self.carrier, self.concurrency, slot_id):
+            sleep_until(wait, deadline, self.carrier)
+        try:
+            yield
+        finally:
+            self.backend.release_slot(self.carrier, slot_id)
+
+    # wrap every outbound request to the carrier in this
+    @contextmanager
+    def limit(self, timeout=None):
+        deadline = time.time() + timeout if timeout else None
+        with self.slot(deadline):
+            self.acquire_token(deadline)
+            yield
+
+
+def sleep_until(wait, deadline, carrier):
+    if deadline is not None and time.time() + wait > deadline:
+        raise RateLimitTimeout(f"Timed out waiting for the {carrier} rate limit")
+    time.sleep(wait)
+
+
+_backend = None
+_limiters = {}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "tracking_RATE_LIMIT_BACKEND", "tracking.ratelimit.DatabaseBackend")
+        _backend = import_string(path)()
+    return _backend
+
+
+def get_limiter(carrier):
+    if carrier not in _limiters:
+        limits = getattr(settings, "tracking_CARRIER_RATE_LIMITS", {}).get(carrier)
+        _limiters[carrier] = CarrierLimiter(carrier, get_backend(), **limits) if limits else None
+    return _limiters[carrier]
+
+
+@contextmanager
+def limit(carrier, timeout=None):
+    limiter = get_limiter(carrier)
+    if limiter is None:
+        yield
+        return
+    with limiter.limit(timeout):
+        yield
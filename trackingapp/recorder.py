@@ -0,0 +1,168 @@
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from tracking import report_cache
+from tracking.rollups import record_latencies, record_trace_log
+
+logger = logging.getLogger(__name__)
+
+# Write-behind buffer for the rows crawlers write while tracing
+# (TraceReportLog, Request, RequestKPI, TrackingErrorLog).
+#
+# Inside ``recording()`` crawlers hand unsaved instances to ``record()``;
+# they are written with bulk_create once ``batch_size`` rows are buffered,
+# and at the latest every ``max_age`` seconds, so a crash loses at most that
+# window. Outside of a recording, ``record()`` saves the row right away.
+#
+#   tracking_RECORDER = {"batch_size": 500, "max_age": 5}
+#
+# bulk_create does not send post_save, so the receivers in tracking.signals
+# are called here for the flushed rows.
+
+DEFAULT_OPTIONS = {
+    "batch_size": 500,
+    # seconds; 0 keeps rows until batch_size or the end of the recording
+    "max_age": 5,
+}
+
+# rows are written parent first, whatever order they were recorded in, so
+# a RequestKPI never goes out before the Request it points at
+FLUSH_ORDER = ("request", "requestkpi", "tracereportlog", "trackingerrorlog")
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def flush_position(model):
+    name = model._meta.model_name
+    return FLUSH_ORDER.index(name) if name in FLUSH_ORDER else len(FLUSH_ORDER)
+
+
+class BufferedRecorder:
+    def __init__(self, batch_size=None, max_age=None):
+        options = {**DEFAULT_OPTIONS, **getattr(settings, "tracking_RECORDER", {})}
+        self.batch_size = batch_size or options["batch_size"]
+        self.max_age = options["max_age"] if max_age is None else max_age
+        # model -> rows
+        self.buffers = {}
+        self.buffered = 0
+        self.oldest = None
+        self.lock = threading.RLock()
+        self.flushed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, instance):
+        with self.lock:
+            self.buffers.setdefault(type(instance), []).append(instance)
+            self.buffered += 1
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if self.buffered >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            buffers, self.buffers = self.buffers, {}
+            self.buffered = 0
+            self.oldest = None
+            for model in sorted(buffers, key=flush_position):
+                self.write(model, buffers[model])
+
+    def write(self, model, rows):
+        try:
+            with transaction.atomic():
+                created = model.objects.bulk_create(rows, batch_size=self.batch_size)
+        except Exception:
+            # one bad row must not take the rest of the batch with it; save()
+            # sends post_save, so these rows skip after_write
+            logger.exception(f"Bulk insert of {len(rows)} {model.__name__} rows failed, saving one by one")
+            for row in rows:
+                try:
+                    row.save()
+                except Exception:
+                    logger.exception(f"Could not save {model.__name__} row")
+                    continue
+                self.flushed += 1
+            return
+        self.flushed += len(created)
+        self.after_write(model, created)
+
+    def after_write(self, model, rows):
+        if not rows:
+            return
+        name = model._meta.model_name
+        if name == "tracereportlog":
+            for row in rows:
+                record_trace_log(row)
+            report_cache.invalidate_today()
+        elif name == "requestkpi":
+            record_latencies(rows)
+
+    def _flush_old(self):
+        # time-bounded flushes for crawlers that record slowly
+        while not self._stop.wait(min(self.max_age, 1)):
+            if self.oldest is not None and time.monotonic() - self.oldest >= self.max_age:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Periodic flush failed")
+                finally:
+                    connection.close()
+
+    def start(self):
+        if self.max_age:
+            self._thread = threading.Thread(target=self._flush_old, name="recorder-flush", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        atexit.unregister(self.close)
+
+
+# buffers the rows recorded while the block runs; the buffer is flushed on
+# the way out, including on SoftTimeLimitExceeded and other errors
+@contextmanager
+def recording(**options):
+    global _active
+    with _active_lock:
+        outer = _active
+        if outer is None:
+            recorder = _active = BufferedRecorder(**options)
+    if outer is not None:
+        # nested recordings share the outer buffer
+        yield outer
+        return
+    recorder.start()
+    try:
+        yield recorder
+    finally:
+        with _active_lock:
+            _active = None
+        recorder.close()
+        logger.debug(f"Recorder flushed {recorder.flushed} rows")
+
+
+def record(instance):
+    recorder = _active
+    if recorder is None:
+        instance.save()
+    else:
+        recorder.record(instance)
+    return instance
+
+
+def record_many(instances):
+    for instance in instances:
+        record(instance)
@@ -0,0 +1,40 @@
+import threading
+from collections.abc import Mapping
+
+from django.utils.module_loading import import_string
+
+
+# name -> crawler class, declared as dotted paths and imported on first use.
+# Membership checks and iteration never import anything, so web processes
+# that only validate crawler names don't pay for any carrier's dependencies.
+class CrawlerRegistry(Mapping):
+    def __init__(self, paths):
+        self._paths = dict(paths)
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        try:
+            return self._loaded[name]
+        except KeyError:
+            pass
+        path = self._paths[name]
+        with self._lock:
+            if name not in self._loaded:
+                self._loaded[name] = import_string(path)
+        return self._loaded[name]
+
+    def __contains__(self, name):
+        return name in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def path(self, name):
+        return self._paths[name]
+
+    def is_loaded(self, name):
+        return name in self._loaded
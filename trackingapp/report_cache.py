@@ -0,0 +1,101 @@
+import hashlib
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+# Report results keyed by (route, fromDate, toDate). Closed ranges are
+# stored for tracking_REPORT_CACHE_CLOSED_TIMEOUT under a "closed" generation
+# that is only bumped when past rollup buckets change (a backfill or a late
+# trace log). Ranges that reach today carry a generation number that is
+# bumped whenever a TraceReportLog row is written. Row lists longer than
+# tracking_REPORT_CACHE_MAX_ROWS are not cached.
+
+KEY_PREFIX = "tracking:report"
+GENERATION_KEY = f"{KEY_PREFIX}:today-generation"
+CLOSED_GENERATION_KEY = f"{KEY_PREFIX}:closed-generation"
+HITS_KEY = f"{KEY_PREFIX}:hits"
+MISSES_KEY = f"{KEY_PREFIX}:misses"
+
+TIMEOUT = getattr(settings, "tracking_REPORT_CACHE_TIMEOUT", 60 * 60)
+# entries of older generations are never read again and expire with this
+CLOSED_TIMEOUT = getattr(settings, "tracking_REPORT_CACHE_CLOSED_TIMEOUT", 7 * 24 * 60 * 60)
+MAX_ROWS = getattr(settings, "tracking_REPORT_CACHE_MAX_ROWS", 10000)
+
+
+def get_cache():
+    return caches[getattr(settings, "tracking_REPORT_CACHE_ALIAS", "default")]
+
+
+def touches_today(_to):
+    try:
+        return datetime.strptime(_to, "%Y-%m-%d").date() >= timezone.localdate()
+    except ValueError:
+        return True
+
+
+def cache_key(route, _from, _to):
+    # the dates come straight from the query string; hashing keeps the key
+    # short and free of characters memcached rejects
+    digest = hashlib.md5(f"{route}:{_from}:{_to}".encode()).hexdigest()
+    generation_key = GENERATION_KEY if touches_today(_to) else CLOSED_GENERATION_KEY
+    generation = get_cache().get_or_set(generation_key, 1, None)
+    return f"{KEY_PREFIX}:{digest}:{generation}"
+
+
+def count(key):
+    cache = get_cache()
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add() and incr()
+        cache.set(key, 1, None)
+
+
+def get(route, _from, _to):
+    value = get_cache().get(cache_key(route, _from, _to))
+    # file reports are cached by path; treat a cleaned-up download as a miss
+    if value is not None and isinstance(value, dict) and "file_path" in value:
+        if not os.path.exists(value["file_path"]):
+            value = None
+    count(HITS_KEY if value is not None else MISSES_KEY)
+    return value
+
+
+def set(route, _from, _to, value):
+    if isinstance(value, list) and len(value) > MAX_ROWS:
+        return
+    timeout = TIMEOUT if touches_today(_to) else CLOSED_TIMEOUT
+    get_cache().set(cache_key(route, _from, _to), value, timeout)
+
+
+def bump(generation_key):
+    cache = get_cache()
+    cache.add(generation_key, 1, None)
+    try:
+        cache.incr(generation_key)
+    except ValueError:
+        cache.set(generation_key, 2, None)
+
+
+def invalidate_today():
+    bump(GENERATION_KEY)
+
+
+def invalidate_closed():
+    bump(CLOSED_GENERATION_KEY)
+
+
+def stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else 0,
+    }
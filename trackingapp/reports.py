@@ -0,0 +1,211 @@
+import os
+import socket
+from datetime import datetime
+from functools import lru_cache
+
+import xlwt
+from django.conf import settings
+from django.db.models import CharField, F, Func, Max, Sum, Value
+from django.template.loader import get_template
+
+from tracking.models import TraceReportLog
+from tracking.rollups import DAY, TraceReportRollup
+from tracking.xlsx_stream import stream_xlsx
+
+UNITTRACES = "unittraces"
+WEBCRAWLERS = "webcrawlers"
+
+REPORT_NAMES = {
+    UNITTRACES: "UnitTraces Report",
+    WEBCRAWLERS: "WebCrawlers Report",
+}
+
+COLUMNS = [
+    "Name",
+    "Website",
+    "Website Status",
+    "Last Traced",
+    "Units Traced",
+    "Successes",
+    "Failures",
+]
+
+CONTENT_TYPES = {
+    "xls": "application/ms-excel",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pdf": "application/pdf",
+}
+
+
+# accepts the spellings used by the routes, the email schedules and the
+# legacy helpers ("unittraces", "UnitTraces", "webcrawler", "WebCrawlers Report")
+def normalize_report_type(report_type):
+    if report_type.lower().replace(" ", "").startswith(UNITTRACES):
+        return UNITTRACES
+    return WEBCRAWLERS
+
+
+def build_report_queryset(report_type, from_date, to_date):
+    report_type = normalize_report_type(report_type)
+    values = [
+        "website_id__name",
+        "website_id__status",
+        "website_id",
+        "website_id__category",
+    ]
+    if report_type == WEBCRAWLERS:
+        return build_webcrawlers_queryset(values, from_date, to_date)
+    values += ["units_traced", "success"]
+    alias = {
+        "name": F("website_id__name"),
+        "status": F("website_id__status"),
+        "category": F("website_id__category"),
+        "created_at": Func(
+            "created_at",
+            Value("yyyy-mm-dd hh12:mi:ss AM"),
+            function="to_char",
+            output_field=CharField(),
+        ),
+        "failures": F("units_traced") - F("success"),
+    }
+    return (
+        TraceReportLog.objects.filter(created_at__lte=to_date, created_at__gte=from_date)
+        .select_related("website_id")
+        .values(*values)
+        .annotate(**alias)
+    )
+
+
+# per-website totals over the range, read from the daily rollup instead of
+# aggregating raw TraceReportLog rows
+def build_webcrawlers_queryset(values, from_date, to_date):
+    annotate = {
+        "units_traced": Sum("total_units_traced"),
+        "success": Sum("total_success"),
+        "failures": F("units_traced") - F("success"),
+        "created_at": Func(
+            Max("last_traced"),
+            Value("yyyy-mm-dd hh12:mi:ss AM"),
+            function="to_char",
+            output_field=CharField(),
+        ),
+        "name": F("website_id__name"),
+        "status": F("website_id__status"),
+        "category": F("website_id__category"),
+    }
+    return (
+        TraceReportRollup.objects.filter(period=DAY, bucket__lte=to_date, bucket__gte=from_date)
+        .values(*values)
+        .annotate(**annotate)
+        .order_by("website_id__name")
+    )
+
+
+def report_rows(items):
+    for item in items:
+        yield (
+            "Imports",
+            item["name"],
+            item["status"],
+            item["created_at"],
+            item["units_traced"],
+            item["success"],
+            item["units_traced"] - item["success"],
+        )
+
+
+def iterate_items(items, chunk_size=2000):
+    # server-side cursor for querysets, plain iteration for anything else
+    if hasattr(items, "iterator"):
+        return items.iterator(chunk_size=chunk_size)
+    return iter(items)
+
+
+def report_filename(report_type, extension):
+    prefix = REPORT_NAMES[normalize_report_type(report_type)].replace(" ", "")
+    return f"{prefix}_{datetime.timestamp(datetime.now())}.{extension}"
+
+
+def report_title(report_type, _from, to):
+    return f"{REPORT_NAMES[normalize_report_type(report_type)]}: {_from} - {to}"
+
+
+@lru_cache(maxsize=None)
+def xls_styles():
+    # palette registration and easyxf parsing only need to happen once per process
+    xlwt.add_palette_colour("header_color", 0x21)
+    return {
+        "title": xlwt.easyxf(f"pattern: pattern solid,fore_colour white;font: name Calibri, height {12 * 20};"),
+        "header": xlwt.easyxf(
+            f"pattern: pattern solid, fore_colour header_color;font: name Calibri, bold True, height {12 * 20};"
+        ),
+        "body": xlwt.easyxf(f"font:color-index black, name Calibri, height {12 * 20}"),
+    }
+
+
+def write_xls(items, report_type, _from, to, dest):
+    styles = xls_styles()
+    workbook = xlwt.Workbook()
+    # set custom header color
+    workbook.set_colour_RGB(0x21, 226, 222, 208)
+    worksheet = workbook.add_sheet(REPORT_NAMES[normalize_report_type(report_type)])
+    # freeze first row
+    worksheet.set_panes_frozen(True)
+    worksheet.set_horz_split_pos(1)
+    worksheet.set_vert_split_pos(1)
+    worksheet.write_merge(0, 0, 0, 5, report_title(report_type, _from, to), styles["title"])
+    for column_index, column in enumerate(COLUMNS):
+        worksheet.col(column_index).width = 256 * (len(column) + 4)
+        worksheet.write(2, column_index, column, styles["header"])
+
+    # Start from the first cell below the headers.
+    body = styles["body"]
+    for row, values in enumerate(report_rows(iterate_items(items)), start=3):
+        for col, value in enumerate(values):
+            worksheet.write(row, col, f"{value}", body)
+    workbook.save(dest)
+
+
+def write_xlsx(items, report_type, _from, to, dest):
+    for chunk in stream_xlsx_report(items, report_type, _from, to):
+        dest.write(chunk)
+
+
+def stream_xlsx_report(items, report_type, _from, to):
+    return stream_xlsx(
+        report_rows(iterate_items(items)),
+        COLUMNS,
+        sheet_name=REPORT_NAMES[normalize_report_type(report_type)],
+        title=report_title(report_type, _from, to),
+    )
+
+
+def write_pdf(items, report_type, _from, to, dest, logo_url=None):
+    # xhtml2pdf pulls in reportlab; only PDF jobs should pay for that import
+    from xhtml2pdf import pisa
+
+    template = get_template("public/pdf_reports.html")
+    html = template.render(
+        context={
+            "items": items,
+            "url": logo_url or f"https://{socket.gethostname()}{settings.STATIC_URL}images/client_logo.png",
+            "report_name": report_title(report_type, _from, to),
+        }
+    )
+    pisa.CreatePDF(html, dest=dest)
+
+
+WRITERS = {
+    "xls": write_xls,
+    "xlsx": write_xlsx,
+    "pdf": write_pdf,
+}
+
+
+# writes the report into tracking_DOWNLOADS_DIR and returns the file path
+def generate_report_file(file_format, items, report_type, _from, to, **kwargs):
+    filename = report_filename(report_type, file_format)
+    file_path = os.path.join(settings.tracking_DOWNLOADS_DIR, filename)
+    with open(file_path, "w+b") as dest:
+        WRITERS[file_format](items, report_type, _from, to, dest, **kwargs)
+    return file_path
@@ -0,0 +1,358 @@
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.conf import settings
+
+from django.db import models, transaction
+from django.db.models import (CharField, Count, DurationField, ExpressionWrapper,
+                              F, IntegerField, Max, Q, Sum, Value)
+from django.db.models.functions import (Cast, Coalesce, Greatest, NullIf,
+                                        TruncDate, TruncDay, TruncHour)
+from django.utils import timezone
+
+from tracking import report_cache
+from tracking.sketches import LatencySketch
+
+HOUR = "hour"
+DAY = "day"
+
+PERIOD_CHOICES = (
+    (HOUR, "Hour"),
+    (DAY, "Day"),
+)
+
+TRUNCATE = {
+    HOUR: TruncHour,
+    DAY: TruncDay,
+}
+
+
+# Pre-aggregated TraceReportLog totals per website and day (reports only
+# read days; the period column leaves room for other bucket sizes). Buckets
+# are in the default timezone, matching TruncDay.
+class TraceReportRollup(models.Model):
+    website = models.ForeignKey("tracking.Website", on_delete=models.CASCADE, related_name="trace_rollups")
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    total_units_traced = models.BigIntegerField(default=0)
+    total_success = models.BigIntegerField(default=0)
+    runs = models.IntegerField(default=0)
+    last_traced = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = "tracking"
+        unique_together = ("website", "period", "bucket")
+        indexes = [models.Index(fields=["period", "bucket"])]
+
+    def __str__(self):
+        return f"{self.website_id} {self.period} {self.bucket}"
+
+
+# midnight of a local date, aware when USE_TZ is on; range filters on these
+# bounds can use the created_at indexes, __date lookups cannot
+def day_start(day):
+    value = datetime.combine(day, time.min)
+    if settings.USE_TZ:
+        return timezone.make_aware(value)
+    return value
+
+
+def bucket_start(value, period):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if period == DAY:
+        value = value.replace(hour=0)
+    return value
+
+
+# called for every new TraceReportLog row; adds it to its day bucket
+def record_trace_log(trace_log):
+    if bucket_start(trace_log.created_at, DAY) < bucket_start(timezone.now(), DAY):
+        # a late row changes a day whose reports are cached for good
+        report_cache.invalidate_closed()
+    rollup, _ = TraceReportRollup.objects.get_or_create(
+        website_id=trace_log.website_id,
+        period=DAY,
+        bucket=bucket_start(trace_log.created_at, DAY),
+    )
+    TraceReportRollup.objects.filter(pk=rollup.pk).update(
+        total_units_traced=F("total_units_traced") + (trace_log.units_traced or 0),
+        total_success=F("total_success") + (trace_log.success or 0),
+        runs=F("runs") + 1,
+        last_traced=Greatest(Coalesce(F("last_traced"), Value(trace_log.created_at)), Value(trace_log.created_at)),
+    )
+
+
+# recomputes the day bucket of a TraceReportLog row that was edited or
+# deleted; the increments above cannot be undone (last_traced). Rows changed
+# with QuerySet.update() send no signal and need backfill_trace_rollups
+def rebuild_trace_day(website_id, created_at):
+    from tracking.models import TraceReportLog
+
+    day = bucket_start(created_at, DAY)
+    totals = TraceReportLog.objects.filter(
+        website_id=website_id,
+        created_at__gte=day,
+        created_at__lt=day_start(day.date() + timedelta(days=1)),
+    ).aggregate(
+        units_traced_total=Sum("units_traced"),
+        success_total=Sum("success"),
+        runs=Count("id"),
+        last_traced=Max("created_at"),
+    )
+    rollups = TraceReportRollup.objects.filter(website_id=website_id, period=DAY, bucket=day)
+    if totals["runs"]:
+        rollups.update_or_create(
+            website_id=website_id,
+            period=DAY,
+            bucket=day,
+            defaults={
+                "total_units_traced": totals["units_traced_total"] or 0,
+                "total_success": totals["success_total"] or 0,
+                "runs": totals["runs"],
+                "last_traced": totals["last_traced"],
+            },
+        )
+    else:
+        rollups.delete()
+    if day < bucket_start(timezone.now(), DAY):
+        report_cache.invalidate_closed()
+    report_cache.invalidate_today()
+
+
+# rebuilds the buckets of [from_date, to_date) from raw TraceReportLog rows;
+# the bounds should fall on bucket boundaries
+def backfill_trace_rollups(period, from_date, to_date, batch_size=1000):
+    # tracking.models imports this module to register the rollup models
+    from tracking.models import TraceReportLog
+
+    totals = (
+        TraceReportLog.objects.filter(created_at__gte=from_date, created_at__lt=to_date)
+        .annotate(bucket=TRUNCATE[period]("created_at"))
+        .values("website_id", "bucket")
+        .annotate(
+            units_traced_total=Sum("units_traced"),
+            success_total=Sum("success"),
+            runs=Count("id"),
+            last_traced=Max("created_at"),
+        )
+        .order_by()
+    )
+    rows = totals.iterator()
+    created = 0
+    with transaction.atomic():
+        TraceReportRollup.objects.filter(period=period, bucket__gte=from_date, bucket__lt=to_date).delete()
+        while batch := list(islice(rows, batch_size)):
+            TraceReportRollup.objects.bulk_create(
+                TraceReportRollup(
+                    website_id=row["website_id"],
+                    period=period,
+                    bucket=row["bucket"],
+                    total_units_traced=row["units_traced_total"] or 0,
+                    total_success=row["success_total"] or 0,
+                    runs=row["runs"],
+                    last_traced=row["last_traced"],
+                )
+                for row in batch
+            )
+            created += len(batch)
+    report_cache.invalidate_closed()
+    return created
+
+
+# Per website and day RequestKPI totals for the three crawler legs: TMDB GET,
+# carrier POST and TMDB POST. Refreshed by tasks.rollup_request_kpis.
+class RequestKPIRollup(models.Model):
+    website = models.ForeignKey("tracking.Website", on_delete=models.CASCADE, related_name="kpi_rollups")
+    day = models.DateField()
+    request_count = models.IntegerField(default=0)
+    tmdb_get_count = models.IntegerField(default=0)
+    api_post_count = models.IntegerField(default=0)
+    tmdb_post_count = models.IntegerField(default=0)
+    containers_pulled_from_tmdb = models.BigIntegerField(default=0)
+    containers_data_get_from_api = models.BigIntegerField(default=0)
+    containers_pushed_to_tmdb = models.BigIntegerField(default=0)
+    total_duration = models.DurationField(null=True, blank=True)
+    tmdb_get_duration = models.DurationField(null=True, blank=True)
+    api_post_duration = models.DurationField(null=True, blank=True)
+    tmdb_post_duration = models.DurationField(null=True, blank=True)
+    last_tmdb_get_start = models.DateTimeField(null=True, blank=True)
+    last_tmdb_post_stop = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = "tracking"
+        unique_together = ("website", "day")
+        indexes = [models.Index(fields=["day"])]
+
+    def __str__(self):
+        return f"{self.website_id} {self.day}"
+
+
+KPI_LEGS = {
+    "tmdb_get": Q(sender="tracking", receiver="TMDB", method="GET"),
+    "api_post": Q(sender="tracking", receiver=F("website__name"), method="POST"),
+    "tmdb_post": Q(sender="tracking", receiver="TMDB", method="POST"),
+}
+
+
+def kpi_aggregates():
+    duration = ExpressionWrapper(F("stop_time") - F("start_time"), output_field=DurationField())
+    containers = Cast(NullIf(Cast("containers", CharField()), Value("")), IntegerField())
+    tmdb_get, api_post, tmdb_post = KPI_LEGS["tmdb_get"], KPI_LEGS["api_post"], KPI_LEGS["tmdb_post"]
+    return {
+        "request_count": Count("id"),
+        "tmdb_get_count": Count("id", filter=tmdb_get),
+        "api_post_count": Count("id", filter=api_post),
+        "tmdb_post_count": Count("id", filter=tmdb_post),
+        "containers_pulled_from_tmdb": Coalesce(Sum(containers, filter=tmdb_get), 0),
+        "containers_data_get_from_api": Coalesce(Sum(containers, filter=api_post), 0),
+        "containers_pushed_to_tmdb": Coalesce(Sum(containers, filter=tmdb_post), 0),
+        "total_duration": Sum(duration),
+        "tmdb_get_duration": Sum(duration, filter=tmdb_get),
+        "api_post_duration": Sum(duration, filter=api_post),
+        "tmdb_post_duration": Sum(duration, filter=tmdb_post),
+        "last_tmdb_get_start": Max("start_time", filter=tmdb_get),
+        "last_tmdb_post_stop": Max("stop_time", filter=tmdb_post),
+    }
+
+
+# recomputes the rollup rows of every day in [from_day, to_day]; safe to run
+# repeatedly, late rows are picked up on the next run
+def rollup_request_kpis(from_day, to_day):
+    from tracking.models import RequestKPI
+
+    totals = (
+        RequestKPI.objects.filter(
+            created_at__gte=day_start(from_day), created_at__lt=day_start(to_day + timedelta(days=1))
+        )
+        .annotate(day=TruncDate("created_at"))
+        .values("website_id", "day")
+        .annotate(**kpi_aggregates())
+        .order_by()
+    )
+    updated = 0
+    with transaction.atomic():
+        for row in totals.iterator():
+            website_id, day = row.pop("website_id"), row.pop("day")
+            RequestKPIRollup.objects.update_or_create(website_id=website_id, day=day, defaults=row)
+            updated += 1
+    return updated
+
+
+TMDB_GET = "tmdb_get"
+API_POST = "api_post"
+TMDB_POST = "tmdb_post"
+
+LEG_CHOICES = (
+    (TMDB_GET, "TMDB GET"),
+    (API_POST, "Carrier POST"),
+    (TMDB_POST, "TMDB POST"),
+)
+
+
+# days of hourly latency sketches kept before compact_latency_sketches
+# merges them into one row per day
+HOURLY_SKETCH_DAYS = getattr(settings, "tracking_HOURLY_SKETCH_DAYS", 7)
+
+
+# Latency sketch per website, leg and hour; hours older than
+# HOURLY_SKETCH_DAYS are compacted into day rows. See tracking.sketches
+class LatencySketchRollup(models.Model):
+    website = models.ForeignKey("tracking.Website", on_delete=models.CASCADE, related_name="latency_sketches")
+    leg = models.CharField(max_length=9, choices=LEG_CHOICES)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES, default=HOUR)
+    bucket = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    sketch = models.JSONField(default=dict)
+
+    class Meta:
+        app_label = "tracking"
+        unique_together = ("website", "leg", "period", "bucket")
+        indexes = [models.Index(fields=["leg", "bucket"]), models.Index(fields=["period", "bucket"])]
+
+    def __str__(self):
+        return f"{self.website_id} {self.leg} {self.bucket}"
+
+
+def request_kpi_leg(kpi):
+    if kpi.sender != "tracking":
+        return None
+    if kpi.receiver == "TMDB":
+        return {"GET": TMDB_GET, "POST": TMDB_POST}.get(kpi.method)
+    if kpi.method == "POST":
+        return API_POST
+    return None
+
+
+# adds the latency of each RequestKPI to its website/leg/hour sketch; rows
+# are grouped first so a batch touches each sketch row once
+def record_latencies(kpis):
+    grouped = {}
+    for kpi in kpis:
+        leg = request_kpi_leg(kpi)
+        if leg is None or kpi.start_time is None or kpi.stop_time is None:
+            continue
+        key = (kpi.website_id, leg, bucket_start(kpi.start_time, HOUR))
+        grouped.setdefault(key, LatencySketch()).add((kpi.stop_time - kpi.start_time).total_seconds())
+
+    for (website_id, leg, bucket), sketch in grouped.items():
+        with transaction.atomic():
+            row, _ = LatencySketchRollup.objects.select_for_update().get_or_create(
+                website_id=website_id, leg=leg, period=HOUR, bucket=bucket
+            )
+            if row.sketch:
+                sketch = LatencySketch.from_dict(row.sketch).merge(sketch)
+            row.sketch = sketch.to_dict()
+            row.count = sketch.count
+            row.save(update_fields=["sketch", "count"])
+
+
+# merges the hourly sketches of each day before the retention window into
+# a DAY row, one day per transaction; a late hour for a compacted day is
+# merged into the existing day row on the next run
+def compact_latency_sketches(keep_days=HOURLY_SKETCH_DAYS):
+    cutoff = day_start(timezone.localdate() - timedelta(days=keep_days))
+    hourly = LatencySketchRollup.objects.filter(period=HOUR, bucket__lt=cutoff)
+    compacted = 0
+    while True:
+        oldest = hourly.order_by("bucket").values_list("bucket", flat=True).first()
+        if oldest is None:
+            return compacted
+        day = bucket_start(oldest, DAY)
+        next_day = day_start(day.date() + timedelta(days=1))
+        with transaction.atomic():
+            rows = list(
+                hourly.select_for_update().filter(bucket__gte=day, bucket__lt=next_day).order_by("pk")
+            )
+            merged = {}
+            for row in rows:
+                sketch = LatencySketch.from_dict(row.sketch)
+                key = (row.website_id, row.leg)
+                merged[key] = merged[key].merge(sketch) if key in merged else sketch
+            for (website_id, leg), sketch in merged.items():
+                day_row, _ = LatencySketchRollup.objects.select_for_update().get_or_create(
+                    website_id=website_id, leg=leg, period=DAY, bucket=day
+                )
+                if day_row.sketch:
+                    sketch = LatencySketch.from_dict(day_row.sketch).merge(sketch)
+                day_row.sketch = sketch.to_dict()
+                day_row.count = sketch.count
+                day_row.save(update_fields=["sketch", "count"])
+            LatencySketchRollup.objects.filter(pk__in=[row.pk for row in rows]).delete()
+        compacted += len(rows)
+
+
+# hours and compacted days never overlap, so a range reads both kinds of
+# row; long ranges are mostly day rows. to_date is exclusive
+def latency_percentiles(leg, from_date=None, to_date=None, quantiles=(0.5, 0.95, 0.99), **filters):
+    rows = LatencySketchRollup.objects.filter(leg=leg, **filters)
+    if from_date is not None:
+        rows = rows.filter(bucket__gte=from_date)
+    if to_date is not None:
+        rows = rows.filter(bucket__lt=to_date)
+    merged = LatencySketch()
+    for sketch in rows.values_list("sketch", flat=True).iterator():
+        merged.merge(LatencySketch.from_dict(sketch))
+    return {q: merged.quantile(q) for q in quantiles}
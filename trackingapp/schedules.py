@@ -0,0 +1,44 @@
+import json
+
+from django.conf import settings
+from django_celery_beat.models import IntervalSchedule, PeriodicTask
+
+# Beat entries the app itself depends on, kept in django_celery_beat's tables
+# so the DatabaseScheduler picks them up. ensure_periodic_tasks() runs after
+# every migrate; entries are only created, never overwritten, so a schedule
+# changed in the admin stays as it is.
+
+KPI_ROLLUP_EVERY = getattr(settings, "tracking_KPI_ROLLUP_EVERY_MINUTES", 5)
+SKETCH_COMPACTION_EVERY = getattr(settings, "tracking_SKETCH_COMPACTION_EVERY_MINUTES", 24 * 60)
+ERROR_DIGEST_FLUSH_EVERY = getattr(settings, "tracking_ERROR_DIGEST_FLUSH_EVERY_MINUTES", 1)
+
+PERIODIC_TASKS = {
+    "tracking: roll up request KPIs": {
+        "task": "tracking.tasks.rollup_request_kpis",
+        "every": KPI_ROLLUP_EVERY,
+        "kwargs": {"days": 2},
+    },
+    "tracking: compact latency sketches": {
+        "task": "tracking.tasks.compact_latency_sketches",
+        "every": SKETCH_COMPACTION_EVERY,
+        "kwargs": {},
+    },
+    "tracking: send error digests": {
+        "task": "tracking.tasks.flush_error_digests",
+        "every": ERROR_DIGEST_FLUSH_EVERY,
+        "kwargs": {},
+    },
+}
+
+
+def ensure_periodic_tasks():
+    for name, entry in PERIODIC_TASKS.items():
+        if PeriodicTask.objects.filter(name=name).exists():
+            continue
+        interval, _ = IntervalSchedule.objects.get_or_create(every=entry["every"], period=IntervalSchedule.MINUTES)
+        PeriodicTask.objects.create(
+            name=name,
+            task=entry["task"],
+            interval=interval,
+            kwargs=json.dumps(entry["kwargs"]),
+        )
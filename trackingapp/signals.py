@@ -0,0 +1,60 @@
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from tracking import report_cache, schedules
+from tracking.models import (Notification, RequestKPI, ScacCodes,
+                             TraceReportLog)
+from tracking.notifications import invalidate_error_recipients
+from tracking.rollups import (rebuild_trace_day, record_latencies,
+                              record_trace_log)
+from tracking.utils import invalidate_scac_codes
+
+
+@receiver(pre_save, sender=TraceReportLog)
+def remember_trace_bucket(sender, instance, **kwargs):
+    # the bucket an edited row is leaving, see update_trace_rollups
+    instance._previous_bucket = None
+    if instance.pk is not None:
+        instance._previous_bucket = (
+            TraceReportLog.objects.filter(pk=instance.pk).values_list("website_id", "created_at").first()
+        )
+
+
+@receiver(post_save, sender=TraceReportLog)
+def update_trace_rollups(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_bucket", None)
+    if created or previous is None:
+        record_trace_log(instance)
+        report_cache.invalidate_today()
+        return
+    rebuild_trace_day(*previous)
+    if previous != (instance.website_id, instance.created_at):
+        rebuild_trace_day(instance.website_id, instance.created_at)
+
+
+@receiver(post_delete, sender=TraceReportLog)
+def remove_from_trace_rollups(sender, instance, **kwargs):
+    rebuild_trace_day(instance.website_id, instance.created_at)
+
+
+@receiver(post_save, sender=RequestKPI)
+def update_latency_sketches(sender, instance, created, **kwargs):
+    if created:
+        record_latencies([instance])
+
+
+@receiver(post_save, sender=ScacCodes)
+@receiver(post_delete, sender=ScacCodes)
+def reload_scac_codes(sender, **kwargs):
+    invalidate_scac_codes()
+
+
+@receiver(post_save, sender=Notification)
+def reload_error_recipients(sender, **kwargs):
+    invalidate_error_recipients()
+
+
+@receiver(post_migrate)
+def install_periodic_tasks(sender, **kwargs):
+    if sender.name == "django_celery_beat" or sender.label == "tracking":
+        schedules.ensure_periodic_tasks()
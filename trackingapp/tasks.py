@@ -1,117 +1,182 @@
+import logging
+
 from celery import shared_task
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from django.utils import timezone
+from tracking import (checkpoints, executor, locks, notifications, recorder,
+                      report_cache, reports, rollups)
+# connects the TraceReportLog rollup receivers in web and worker processes
+from tracking import signals  # noqa: F401
 from tracking.models import ScheduledTask, TraceReportLog
-from tracking.helpers import generate_excel_report, generate_pdf_report
-from django.db.models import Sum,  Value, CharField, Func, F
+from tracking.registry import CrawlerRegistry
 from django.core.mail import EmailMessage
 
-from tracking.Imports.bct_imports import BCTImports
-from tracking.Imports.bpt_imports import BPTImports
-from tracking.Imports.csx_imports import CSXImports
-from tracking.Imports.csx_nashville_imports import CSXImports
-from tracking.Imports.vaports_imports import VAPortsImports
-from tracking.Imports.gpa_imports import GPAImports
-from tracking.Imports.nsrr_imports import NSRRImports
-from tracking.Imports.sgrt_imports import SGRTImports
-from tracking.Imports.uprr_imports import UPRRImports
-from tracking.Imports.cn_imports import CNImports
-from tracking.Imports.sc_imports import SCImports
-from tracking.Imports.bnsf_imports import BNSFImports
-
-
-crawler_classes = {
-    "bct_imports": BCTImports,
-    "bpt_imports": BPTImports,
-    "csx_imports": CSXImports,
-    "csx_nashville_imports": CSXImports,
-    "vaports_imports": VAPortsImports,
-    "gpa_imports": GPAImports,
-    "nsrr_imports": NSRRImports,
-    "sgrt_imports": SGRTImports,
-    "uprr_imports": UPRRImports,
-    "cn_imports": CNImports,
-    "sc_imports": SCImports,
-    "bnsf_imports": BNSFImports,
-}
+logger = logging.getLogger(__name__)
+
+crawler_classes = CrawlerRegistry({
+    "bct_imports": "tracking.Imports.bct_imports.BCTImports",
+    "bpt_imports": "tracking.Imports.bpt_imports.BPTImports",
+    "csx_imports": "tracking.Imports.csx_imports.CSXImports",
+    "csx_nashville_imports": "tracking.Imports.csx_nashville_imports.CSXImports",
+    "vaports_imports": "tracking.Imports.vaports_imports.VAPortsImports",
+    "gpa_imports": "tracking.Imports.gpa_imports.GPAImports",
+    "nsrr_imports": "tracking.Imports.nsrr_imports.NSRRImports",
+    "sgrt_imports": "tracking.Imports.sgrt_imports.SGRTImports",
+    "uprr_imports": "tracking.Imports.uprr_imports.UPRRImports",
+    "cn_imports": "tracking.Imports.cn_imports.CNImports",
+    "sc_imports": "tracking.Imports.sc_imports.SCImports",
+    "bnsf_imports": "tracking.Imports.bnsf_imports.BNSFImports",
+})
 
 
 @shared_task(soft_time_limit=2500,time_limit=2500)
 def run_crawler(crawler: str):
-    global crawler_classes
     if crawler in crawler_classes:
-        crawler_instance = crawler_classes[crawler]()
-        crawler_instance.run()
+        locks.clear_queued(crawler)
+        # beat windows fire every minute and users can trigger runs by hand;
+        # only one instance of a crawler runs at a time
+        with locks.CrawlerRunLock(crawler) as acquired:
+            if not acquired:
+                logger.info(f"{crawler} is already running, skipping")
+                return "already running"
+            crawler_instance = crawler_classes[crawler]()
+            if executor.supports_batches(crawler_instance) and checkpoints.CHUNK_SIZE:
+                start_chunked_run(crawler, crawler_instance)
+                return
+            # rows recorded through tracking.recorder are written in batches
+            with recorder.recording():
+                if executor.supports_batches(crawler_instance):
+                    executor.run_concurrent(crawler, crawler_instance)
+                else:
+                    crawler_instance.run()
     else:
         raise Exception("Invalid Crawler Name")
 
 
+# plans a new checkpointed run, or resumes the open chunks of one that timed
+# out or crashed, and spreads the chunks over the available workers
+def start_chunked_run(crawler, crawler_instance):
+    run_id = checkpoints.get_unfinished_run(crawler)
+    if run_id:
+        logger.info(f"{crawler}: resuming run {run_id}")
+    else:
+        run_id = checkpoints.plan_run(crawler, crawler_instance.get_batches())
+    chunk_indexes = checkpoints.dispatch_chunks(run_id)
+    if chunk_indexes:
+        locks.mark_chunked_run(crawler, run_id, checkpoints.CHUNK_TIMEOUT)
+    for chunk_index in chunk_indexes:
+        run_crawler_chunk.delay(crawler, run_id, chunk_index)
+    finish_crawler_run(crawler, crawler_instance, run_id)
+
+
+@shared_task(
+    acks_late=True,
+    soft_time_limit=checkpoints.CHUNK_TIMEOUT - 60,
+    time_limit=checkpoints.CHUNK_TIMEOUT,
+)
+def run_crawler_chunk(crawler: str, run_id: str, chunk_index: int):
+    chunk = checkpoints.start_chunk(run_id, chunk_index)
+    if chunk is None:
+        return
+    locks.mark_chunked_run(crawler, run_id, checkpoints.CHUNK_TIMEOUT)
+    crawler_instance = crawler_classes[crawler]()
+    try:
+        # the chunk's rows are flushed before it is marked done
+        with recorder.recording():
+            units_traced, success, _ = executor.run_batches(crawler, crawler_instance, chunk.batches)
+    except BaseException:
+        # SoftTimeLimitExceeded included; the chunk is retried on resume
+        checkpoints.fail_chunk(chunk)
+        finish_crawler_run(crawler, crawler_instance, run_id)
+        raise
+    checkpoints.finish_chunk(chunk, units_traced, success)
+    finish_crawler_run(crawler, crawler_instance, run_id)
+
+
+def finish_crawler_run(crawler, crawler_instance, run_id):
+    totals = checkpoints.finish_run_if_complete(run_id)
+    if totals:
+        locks.clear_chunked_run(crawler)
+        TraceReportLog.objects.create(
+            website=crawler_instance.website,
+            units_traced=totals["units_traced"],
+            success=totals["success"],
+        )
+
+
+# scheduled every few minutes (see tracking.schedules); yesterday is included
+# so rows written around midnight land in the right day. Older days are
+# filled by the backfill_request_kpi_rollups management command.
+@shared_task
+def rollup_request_kpis(days=2):
+    today = timezone.localdate()
+    return rollups.rollup_request_kpis(today - timedelta(days=days - 1), today)
+
+
+@shared_task
+def compact_latency_sketches():
+    return rollups.compact_latency_sketches()
+
+
+# sends closed error digest windows whose publishers have since exited
+@shared_task
+def flush_error_digests():
+    return notifications.get_digest().flush()
+
+
 @shared_task
 def scheduled_task_cleanup():
     ScheduledTask.objects.filter(disable_datetime__lte=datetime.now(), celery_task__enabled=True).update(celery_task__enabled=False)
 
 
+@shared_task(bind=True)
+def generate_report_job(self, file_format, report_type, from_date, to_date, user_id=None, logo_url=None):
+    # progress is published through the result backend and read back by
+    # views.get_report_job_status
+    route = f"tracking-{reports.normalize_report_type(report_type)}-{file_format}-report"
+    cached = report_cache.get(route, from_date, to_date)
+    if cached is not None:
+        return {**cached, "stage": "done", "user_id": user_id}
+
+    self.update_state(state="PROGRESS", meta={"stage": "querying", "rows": 0, "user_id": user_id})
+    items = reports.build_report_queryset(report_type, f"{from_date} 00:00:00", f"{to_date} 23:59:59")
+    rows = 0
+    if file_format == "pdf":
+        # the PDF template needs every row at once
+        items = list(items)
+        rows = len(items)
+        kwargs = {"logo_url": logo_url}
+    else:
+        kwargs = {}
+
+        # the spreadsheet writers stream from a server-side cursor; rows are
+        # counted as they go by
+        def counted(queryset):
+            nonlocal rows
+            for item in reports.iterate_items(queryset):
+                rows += 1
+                yield item
+
+        items = counted(items)
+    self.update_state(state="PROGRESS", meta={"stage": "rendering", "rows": rows, "user_id": user_id})
+    file_path = reports.generate_report_file(file_format, items, report_type, from_date, to_date, **kwargs)
+    result = {"rows": rows, "file_format": file_format, "file_path": file_path}
+    report_cache.set(route, from_date, to_date, result)
+    return {**result, "stage": "done", "user_id": user_id}
+
+
 @shared_task
 def email_report(email_list, format, report_type, start_date, end_date):
-    # Don't need the task lol
-    report_name = ''
-    items = ()
-    values = [
-        "website_id__name",
-        "website_id__status",
-        "website_id",
-        "website_id__category",
-    ]
-    if report_type == 'UnitTraces':
-        report_name = 'UnitTraces Report'
-        values += ["units_traced", "success"]
-        alias = {
-            "name": F("website_id__name"),
-            "status": F("website_id__status"),
-            "category": F("website_id__category"),
-            "created_at": Func(
-                "created_at",
-                Value("yyyy-mm-dd hh12:mi:ss AM"),
-                function="to_char",
-                output_field=CharField(),
-            ),
-            "failures": F("units_traced") - F("success"),
-        }
-        items = (
-            TraceReportLog.objects.filter(created_at__lte=start_date, created_at__gte=end_date)
-            .select_related("website_id")
-            .values(*values)
-            .annotate(**alias)
-        )
-    else:
-        report_name = 'WebCrawlers Report'
-        alias = {
-            "units_traced": Sum("units_traced"),
-            "success": Sum("success"),
-            "failures": F("units_traced") - F("success"),
-            "created_at": Func(
-                "created_at",
-                Value("yyyy-mm-dd hh12:mi:ss AM"),
-                function="to_char",
-                output_field=CharField(),
-            ),
-            "name": F("website_id__name"),
-            "status": F("website_id__status"),
-            "category": F("website_id__category"),
-        }
-        items = (
-            TraceReportLog.objects.filter(created_at__lte=start_date, created_at__gte=end_date)
-            .select_related("website_id")
-            .values(*values)
-            .annotate(**alias)
-        )
+    report_name = reports.REPORT_NAMES[reports.normalize_report_type(report_type)]
+    # whole days, like the report views and generate_report_job
+    items = reports.build_report_queryset(report_type, f"{start_date} 00:00:00", f"{end_date} 23:59:59")
 
-    file_path = ''
     if format == 'PDF':
-        file_path = generate_pdf_report(items, report_name, start_date, end_date)
+        file_path = reports.generate_report_file('pdf', items, report_type, start_date, end_date)
     else:
         format = 'Excel'
-        file_path = generate_excel_report(items, report_name, start_date, end_date)
+        file_path = reports.generate_report_file('xls', items, report_type, start_date, end_date)
 
     email_msg = EmailMessage(
         subject=f'[tracking] {report_name} - {format}',
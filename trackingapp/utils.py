@@ -1,53 +1,82 @@
 import base64
+import logging
+import uuid
 from datetime import timedelta
 
-import requests
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.cache import cache
 from django.utils import timezone
 
-from tracking.models import Notification, UPRRToken
+from tracking.carrier_http import get_session
+from tracking.credentials import (TokenRequestError, carrier_token,
+                                  get_credential)
+from tracking.notifications import notify_error
+from tracking.models import UPRRToken
 from tracking.models import ScacCodes
 
+logger = logging.getLogger(__name__)
+
+
+@carrier_token("uprr")
+def fetch_uprr_token():
+    # a token persisted by a previous process may still be good after a restart
+    token = UPRRToken.objects.last()
+    if token is not None:
+        expires_at = token.created_at + timedelta(seconds=int(token.expires_in))
+        remaining = (expires_at - timezone.now()).total_seconds()
+        if remaining > get_credential("uprr").refresh_margin:
+            return token.access_token, int(remaining)
 
-def get_api_token():
     credentials = f"{settings.UPRR_USERNAME}:{settings.UPRR_PASSWORD}"
     encoded_credentials = base64.b64encode(credentials.encode()).decode()
     headers = {
         "Authorization": f"Basic {encoded_credentials}",
         "Content-Type": "application/x-www-form-urlencoded",
     }
-    response = requests.post(
+    response = get_session("uprr").post(
         settings.UPRR_TOKEN_URL,
         headers=headers,
         data={"grant_type": "client_credentials"},
     )
-    if response.status_code == 200:
-        token_data = response.json()
-        create_token = UPRRToken.objects.create(
-            access_token=token_data["access_token"],
-            expires_in=token_data["expires_in"],
-            token_type=token_data["token_type"],
+    if response.status_code != 200:
+        raise TokenRequestError(
+            f"Token request failed with status code {response.status_code}", response.text
         )
-        return create_token.access_token
-    else:
-        print(f"Token request failed with status code {response.status_code}")
-        return response.text
+    token_data = response.json()
+    create_token = UPRRToken.objects.create(
+        access_token=token_data["access_token"],
+        expires_in=token_data["expires_in"],
+        token_type=token_data["token_type"],
+    )
+    # only the latest token is ever used
+    UPRRToken.objects.exclude(pk=create_token.pk).delete()
+    return create_token.access_token, int(token_data["expires_in"])
+
+
+uprr_token = get_credential("uprr")
+
+
+# discards the current token (e.g. after the API rejected it) and fetches a new one
+def get_api_token():
+    try:
+        uprr_token.invalidate()
+        UPRRToken.objects.all().delete()
+        return uprr_token.refresh()
+    except TokenRequestError as ex:
+        logger.warning(f"UPRR token request failed: {ex}")
+        return ex.response_text
 
 
 def get_or_create_uprr_token():
-    if UPRRToken.objects.all().exists():
-        token = UPRRToken.objects.last()
-        expired_time = token.created_at + timedelta(seconds=int(token.expires_in))
-        if expired_time >= timezone.now():
-            return token.access_token
-        else:
-            return get_api_token()
-    else:
-        return get_api_token()
+    try:
+        return uprr_token.get()
+    except TokenRequestError as ex:
+        logger.warning(f"UPRR token request failed: {ex}")
+        return ex.response_text
 
 
-def get_cnrr_api_access_token():
+@carrier_token("cnrr")
+def fetch_cnrr_token():
     API_USERNAME = settings.CNRR_USERNAME
     API_PASSWORD = settings.CNRR_PASSWORD
     CREDENTIALS = f"{API_USERNAME}:{API_PASSWORD}"
@@ -57,50 +86,94 @@ def get_cnrr_api_access_token():
         "Content-Type": "application/x-www-form-urlencoded",
         "x-apikey": settings.CNRR_API_KEY,
     }
-    response = requests.post(
+    response = get_session("cnrr").post(
         settings.CNRR_TOKEN_URL,
         headers=HEADERS,
         data={"grant_type": "client_credentials"},
     )
-    return response.json()
+    token_data = response.json()
+    if response.status_code != 200 or "access_token" not in token_data:
+        raise TokenRequestError(
+            f"CN token request failed with status code {response.status_code}", response.text
+        )
+    return token_data, int(token_data.get("expires_in", 0))
 
 
+# same payload as the token endpoint, with expires_in counting down from the
+# cached token's expiry
+def get_cnrr_api_access_token():
+    cnrr_token = get_credential("cnrr")
+    try:
+        token_data = dict(cnrr_token.get())
+    except TokenRequestError as ex:
+        logger.warning(f"CN token request failed: {ex}")
+        return {"error": ex.response_text}
+    token_data["expires_in"] = cnrr_token.expires_in
+    return token_data
+
+
+# errors are debounced into one digest per website, see tracking.notifications
 def send_error_email(website_name, html):
-    emails = (
-        Notification.objects.filter(name="bcc_mail")
-        .values_list("email_list", flat=True)
-        .first()
-    )
-    recipient_list = emails.split(",")
-    send_mail(
-        subject=f"[tracking] Trace Error Notification - {website_name}",
-        message=html,
-        from_email="dun.system.messages@client.com",
-        recipient_list=recipient_list,
-        html_message=html,
-    )
+    notify_error(website_name, html)
 
-def check_duplicates(data_to_trace, logger):
-    response = []
-    containers = []
+
+class TraceEntries(list):
+    # list of entries to trace; ``duplicates`` maps each container listed
+    # more than once to all of its freight bill numbers
+    duplicates = None
+
+
+def iter_traceable(data_to_trace, duplicates):
+    seen = {}
     for entry in data_to_trace:
+        container = entry['CONTAINER_NUMBER']
+        if container in seen:
+            bills = duplicates.get(container)
+            if bills is None:
+                bills = duplicates[container] = [seen[container]]
+            bills.append(entry['BILL_NUMBER'])
+        else:
+            seen[container] = entry['BILL_NUMBER']
         if not entry['SITE_ID'].startswith('L'):
-            response.append(entry)
-        if containers and entry['CONTAINER_NUMBER'] in containers:
-            logger.warn(
-                f"Container # {entry['CONTAINER_NUMBER']}, freight bill # {entry['BILL_NUMBER']}: listed multiple times"
-            )
-        containers.append(entry['CONTAINER_NUMBER'])
+            yield entry
+
+
+def check_duplicates(data_to_trace, logger):
+    duplicates = {}
+    response = TraceEntries(iter_traceable(data_to_trace, duplicates))
+    response.duplicates = duplicates
+    if duplicates:
+        sample = ", ".join(
+            f"{container} ({', '.join(map(str, bills))})" for container, bills in list(duplicates.items())[:10]
+        )
+        logger.warn(f"{len(duplicates)} containers listed multiple times: {sample}")
     return response
 
 
+# SCAC codes are cached per process; signals.py bumps the shared version on
+# any ScacCodes change so every process reloads on its next lookup
+SCAC_CODES_VERSION_KEY = "tracking:scac-codes:version"
+_scac_codes = {"version": None, "codes": None}
+
+
+def get_scac_codes():
+    version = cache.get(SCAC_CODES_VERSION_KEY)
+    if _scac_codes["codes"] is None or _scac_codes["version"] != version:
+        _scac_codes["codes"] = frozenset(ScacCodes.objects.values_list("client_id", flat=True))
+        _scac_codes["version"] = version
+    return _scac_codes["codes"]
+
+
+def invalidate_scac_codes():
+    _scac_codes["codes"] = None
+    cache.set(SCAC_CODES_VERSION_KEY, uuid.uuid4().hex, None)
+
+
 def remove_scaccode(data_to_trace):
-    scac_codes = list(ScacCodes.objects.values_list("client_id", flat=True))
+    scac_codes = get_scac_codes()
     for trace_item in data_to_trace:
         if equipment_id := trace_item.get("BILL_OF_LADING"):
             equipment_id = equipment_id.strip()
-            if len(equipment_id) > 3:
-                equipment_id = equipment_id[:4]
-                if equipment_id in scac_codes:
-                    trace_item['BILL_OF_LADING'] = trace_item['BILL_OF_LADING'][4:]
+            if len(equipment_id) > 3 and equipment_id[:4] in scac_codes:
+                trace_item['BILL_OF_LADING'] = trace_item['BILL_OF_LADING'][4:]
     return data_to_trace
@@ -1,30 +1,39 @@
+import hashlib
 import json
 import os
 from datetime import date, datetime, time, timedelta
-from django.utils import timezone
 
 import dateutil.parser as parser
-import xlwt
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.db.models import CharField, Count, F, Func, Max, Min, Sum, Value
-from django.http import HttpResponse, JsonResponse
+from django.core.cache import cache
+from django.db.models import CharField, Count, DateTimeField, F, Func, Value
+from django.http import (FileResponse, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import render
-from django.template.loader import get_template
 from django.urls import resolve
 from django_celery_beat.models import CrontabSchedule, PeriodicTask
-from tracking import tasks
-from tracking.Crawler.logging_handler import FileLogHandler
+from tracking import locks, report_cache, reports, tasks
+from tracking.async_logging import get_file_logger
 from tracking.forms import NotificationForm, WebsiteForm
 from tracking.helpers import (calculate_seconds, get_cron_end_time,
                                  get_cron_start_time)
 from tracking.models import (LocationDetail, Notification, ScheduledTask,
                                 SystemField, TraceReportLog, Website,
                                 WebsiteMapping, WebsiteMappingValue)
-from xhtml2pdf import pisa
+from tracking.notifications import invalidate_error_recipients
+from tracking.pagination import (InvalidCursor, encode_cursor,
+                                 get_page_size, keyset_overlap, keyset_page)
 import pytz
 
+REPORT_JOB_OWNER_KEY = "tracking:report-job-owner:{}"
+REPORT_JOB_OWNER_TIMEOUT = 24 * 60 * 60
+# a row whose transaction commits after a later row was already sent sorts
+# before the cursor; every poll re-sends this much history before the cursor
+# and clients de-duplicate recent_traces by id
+TRACE_FEED_OVERLAP = timedelta(seconds=getattr(settings, "tracking_TRACE_FEED_OVERLAP_SECONDS", 60))
+
 
 @login_required
 def run_reports(request):
@@ -41,8 +50,17 @@ def run_reports(request):
             website = website_qs.first()
         else:
             website = None
-        logger = FileLogHandler(website=website)
+        logger = get_file_logger(website=website)
         if import_name in tasks.crawler_classes:
+            # repeated clicks coalesce into the queued or running instance
+            if not locks.mark_queued(import_name):
+                logger.debug(f"{import_name} already running")
+                response_data = {
+                    "status": 409,
+                    "response": "already_running",
+                    "message": f"{scheduled_task.name} is already running",
+                }
+                return JsonResponse(response_data, status=409)
             logger.debug(f"{import_name} queued")
             tasks.run_crawler.delay(import_name)
         else:
@@ -340,6 +358,8 @@ def edit_notifications(request):
             email_list=data.get("missingMappingEmails")
         )
         Notification.objects.filter(name="bcc_mail").update(email_list=data.get("bccEmails"))
+        # update() skips post_save
+        invalidate_error_recipients()
         response_data = {
             "status": 200,
             "response": "success",
@@ -368,191 +388,258 @@ def get_tracing_report(request):
         _from = request.GET.get("fromDate", "")
     from_date = f"{_from} 00:00:00"
     to_date = f"{_to} 23:59:59"
-    values = [
-        "website_id__name",
-        "website_id__status",
-        "website_id",
-        "website_id__category",
-    ]
 
     if current_route in [
         "tracking-unittraces-report",
         "tracking-unittraces-pdf-report",
         "tracking-unittraces-excel-report",
     ]:
-        values += ["units_traced", "success"]
-        alias = {
-            "name": F("website_id__name"),
-            "status": F("website_id__status"),
-            "category": F("website_id__category"),
-            "created_at": Func(
-                "created_at",
-                Value("yyyy-mm-dd hh12:mi:ss AM"),
-                function="to_char",
-                output_field=CharField(),
-            ),
-            "failures": F("units_traced") - F("success"),
-        }
-        response = (
-            TraceReportLog.objects.filter(created_at__lte=to_date, created_at__gte=from_date)
-            .select_related("website_id")
-            .values(*values)
-            .annotate(**alias)
-        )
-
+        report_type = reports.UNITTRACES
     else:
-        annotate = {
-            "units_traced": Sum("units_traced"),
-            "success": Sum("success"),
-            "failures": F("units_traced") - F("success"),
-            "created_at": Func(
-                "created_at",
-                Value("yyyy-mm-dd hh12:mi:ss AM"),
-                function="to_char",
-                output_field=CharField(),
-            ),
-            "name": F("website_id__name"),
-            "status": F("website_id__status"),
-            "category": F("website_id__category"),
-        }
-        response = (
-            TraceReportLog.objects.filter(created_at__lte=to_date, created_at__gte=from_date)
-            .select_related("website_id")
-            .values(*values)
-            .annotate(**annotate)
-        )
-    if current_route == "tracking-webcrawlers-excel-report":
-        return generate_excel_report(response, report_type="webcrawler", to=_to, _from=_from)
-    elif current_route == "tracking-unittraces-excel-report":
-        return generate_excel_report(response, report_type="unittraces", to=_to, _from=_from)
+        report_type = reports.WEBCRAWLERS
+    response = reports.build_report_queryset(report_type, from_date, to_date)
+
+    if current_route in [
+        "tracking-webcrawlers-excel-report",
+        "tracking-unittraces-excel-report",
+    ]:
+        # ?format=xlsx streams the rows from a server-side cursor instead of
+        # building the legacy .xls workbook in memory
+        if request.GET.get("format", "").lower() == "xlsx":
+            streaming_response = StreamingHttpResponse(
+                reports.stream_xlsx_report(response, report_type, _from, _to),
+                content_type=reports.CONTENT_TYPES["xlsx"],
+            )
+            filename = reports.report_filename(report_type, "xlsx")
+            streaming_response["Content-Disposition"] = f"attachment; filename={filename}"
+            return streaming_response
+        cached = report_cache.get(current_route, _from, _to)
+        if cached is None:
+            cached = {"file_path": reports.generate_report_file("xls", response, report_type, _from, _to)}
+            report_cache.set(current_route, _from, _to, cached)
+        return report_file_response(cached["file_path"], "xls")
     elif current_route in [
         "tracking-unittraces-pdf-report",
         "tracking-webcrawlers-pdf-report",
     ]:
-        download_folder = settings.tracking_DOWNLOADS_DIR
-        if current_route == "tracking-unittraces-pdf-report":
-            filename = f"UnitTracesReport_{datetime.timestamp(datetime.now())}.pdf"
-            report_name = "UnitTraces Report"
-        else:
-            filename = f"WebCrawlersReport_{datetime.timestamp(datetime.now())}.pdf"
-            report_name = "WebCrawlers Report"
-        template = get_template("public/pdf_reports.html")
-        html = template.render(
-            context={
-                "items": response,
-                "url": f"https://{request.get_host()}{settings.STATIC_URL}images/client_logo.png",
-                "report_name": f"{report_name}: {_from} - {_to}",
-            }
-        )
+        # PDF rendering runs in a worker; poll get_report_job_status and
+        # fetch the file from download_report_job
+        return enqueue_report_job(request, "pdf", report_type, _from, _to)
+    cached = report_cache.get(current_route, _from, _to)
+    if cached is None:
+        cached = list(response)
+        report_cache.set(current_route, _from, _to, cached)
+    return JsonResponse(cached, safe=False, status=200)
 
-        # create a pdf
-        file = open(os.path.join(download_folder, filename), "w+b")
-        pisa_status = pisa.CreatePDF(html, dest=file)
-        with open(os.path.join(download_folder, filename), "rb") as file_path:
-            response = HttpResponse(file_path.read(), content_type="application/pdf")
-            response["Content-Disposition"] = f"attachment; filename={filename}"
-        return response
-    return JsonResponse(list(response), safe=False, status=200)
-
-
-def generate_excel_report(response, report_type="unittraces", to="", _from=""):
-    columns = [
-        "Name",
-        "Website",
-        "Website Status",
-        "Last Traced",
-        "Units Traced",
-        "Successes",
-        "Failures",
-    ]
-    # add custom color for header
-    xlwt.add_palette_colour("header_color", 0x21)
-    # Create a workbook and add a worksheet.
-    workbook = xlwt.Workbook()
-    # set custom header color
-    workbook.set_colour_RGB(0x21, 226, 222, 208)
-    if report_type == "unittraces":
-        worksheet = workbook.add_sheet("UnitTraces Report")
-    else:
-        worksheet = workbook.add_sheet("WebCrawlers Report")
-    # freeze first row
-    worksheet.set_panes_frozen(True)
-    worksheet.set_horz_split_pos(1)
-    worksheet.set_vert_split_pos(1)
-    # set font size to 12
-    style = xlwt.easyxf(f"pattern: pattern solid,fore_colour white;font: name Calibri, height {12 * 20};")
-    if report_type == "unittraces":
-        header_column = f"UnitTraces Report: {_from} - {to}"
+
+@login_required
+def get_report_cache_stats(request):
+    if request.method == "GET":
+        return JsonResponse(report_cache.stats(), status=200)
     else:
-        header_column = f"WebCrawlers Report: {_from} - {to}"
-    worksheet.write_merge(0, 0, 0, 5, header_column, style)
-    # set font size to 12
-    style = xlwt.easyxf(
-        f"pattern: pattern solid, fore_colour header_color;font: name Calibri, bold True, height {12 * 20};"
+        return render(request, "public/405.html", status=405)
+
+
+def enqueue_report_job(request, file_format, report_type, _from, _to):
+    job = tasks.generate_report_job.delay(
+        file_format,
+        report_type,
+        _from,
+        _to,
+        user_id=request.user.pk,
+        logo_url=f"https://{request.get_host()}{settings.STATIC_URL}images/client_logo.png",
     )
-    for column_index, column in enumerate(columns):
-        worksheet.col(column_index).width = 256 * (len(column) + 4)
-        worksheet.write(2, column_index, column, style)
-
-    # Start from the first cell below the headers.
-    row = 3
-    col = 0
-    # set font size to 12
-    style = xlwt.easyxf(f"font:color-index black, name Calibri, height {12 * 20}")
-
-    for item in response:
-        worksheet.write(row, col, "Imports", style)
-        worksheet.write(row, col + 1, f"{item['name']}", style)
-        worksheet.write(row, col + 2, f"{item['status']}", style)
-        worksheet.write(row, col + 3, f"{item['created_at']}", style)
-        worksheet.write(row, col + 4, f"{item['units_traced']}", style)
-        worksheet.write(row, col + 5, f"{item['success']}", style)
-        worksheet.write(row, col + 6, f"{item['units_traced'] - item['success']}", style)
-        row += 1
-    if report_type == "unittraces":
-        filename = f"UnitTracesReport_{datetime.timestamp(datetime.now())}.xls"
+    # failed jobs carry the exception instead of the user_id meta
+    cache.set(REPORT_JOB_OWNER_KEY.format(job.id), request.user.pk, REPORT_JOB_OWNER_TIMEOUT)
+    response_data = {"status": 202, "response": "queued", "job_id": job.id}
+    return JsonResponse(response_data, status=202)
+
+
+@login_required
+def submit_report_job(request):
+    if request.method == "POST":
+        data = json.load(request)
+        file_format = data.get("format", "pdf").lower()
+        if file_format not in reports.WRITERS:
+            return JsonResponse({"status": 400, "response": "error", "message": "Unknown format"}, status=400)
+        return enqueue_report_job(
+            request,
+            file_format,
+            reports.normalize_report_type(data.get("report_type", "")),
+            data.get("fromDate", ""),
+            data.get("toDate", ""),
+        )
     else:
-        filename = f"WebCrawlersReport_{datetime.timestamp(datetime.now())}.xls"
+        return render(request, "public/405.html", status=405)
 
-    download_folder = settings.tracking_DOWNLOADS_DIR
-    workbook.save(f"{os.path.join(download_folder, filename)}")
-    with open(os.path.join(download_folder, filename), "rb") as file_path:
-        response = HttpResponse(file_path.read(), content_type="application/ms-excel")
-        response["Content-Disposition"] = f"attachment; filename={filename}"
-        return response
+
+# (None, {}) for jobs that are not the user's, or whose owner is unknown
+def get_report_job(request, job_id):
+    job = tasks.generate_report_job.AsyncResult(job_id)
+    info = job.info if isinstance(job.info, dict) else {}
+    owner = cache.get(REPORT_JOB_OWNER_KEY.format(job_id), info.get("user_id"))
+    if owner is None or owner != request.user.pk:
+        return None, {}
+    return job, info
+
+
+def report_job_not_found(job_id):
+    response_data = {"status": 404, "response": "not found", "job_id": job_id}
+    return JsonResponse(response_data, status=404)
+
+
+@login_required
+def get_report_job_status(request, job_id):
+    if request.method == "GET":
+        job, info = get_report_job(request, job_id)
+        if job is None:
+            return report_job_not_found(job_id)
+        response_data = {
+            "job_id": job_id,
+            "state": job.state,
+            "stage": info.get("stage", ""),
+            "rows": info.get("rows", 0),
+            "ready": job.state == "SUCCESS",
+        }
+        if job.state == "FAILURE":
+            response_data["message"] = str(job.info)
+        return JsonResponse(response_data, status=200)
+    else:
+        return render(request, "public/405.html", status=405)
+
+
+@login_required
+def download_report_job(request, job_id):
+    if request.method == "GET":
+        job, info = get_report_job(request, job_id)
+        if job is None:
+            return report_job_not_found(job_id)
+        if job.state != "SUCCESS" or not info.get("file_path"):
+            response_data = {"status": 409, "response": "pending", "state": job.state}
+            return JsonResponse(response_data, status=409)
+        return report_file_response(info["file_path"], info["file_format"])
+    else:
+        return render(request, "public/405.html", status=405)
+
+
+def report_file_response(file_path, file_format):
+    response = FileResponse(open(file_path, "rb"), content_type=reports.CONTENT_TYPES[file_format])
+    response["Content-Disposition"] = f"attachment; filename={os.path.basename(file_path)}"
+    return response
+
+
+def get_time_zone(request):
+    timeZ = request.GET.get('timeZ', '')
+    if timeZ not in pytz.all_timezones_set:
+        timeZ = settings.TIME_ZONE
+    return timeZ
+
+
+def recent_trace_values(queryset, timeZ):
+    alias = {
+        "name": F("website__name"),
+        "status": F("website__status"),
+        "category": F("website__category"),
+        # convert and format in the database instead of per row in Python
+        "last_traced": Func(
+            Func(Value(timeZ), F("created_at"), function="timezone", output_field=DateTimeField()),
+            Value("YYYY-MM-DD HH12:MI:SS AM"),
+            function="to_char",
+            output_field=CharField(),
+        ),
+    }
+    return queryset.values(
+        "id",
+        "created_at",
+        "website__name",
+        "website__status",
+        "units_traced",
+        "website",
+        "success",
+        "website__category",
+    ).annotate(**alias)
+
+
+def get_website_statuses():
+    website_statuses = list(
+        Website.objects.values("status").annotate(status_count=Count("status")).order_by("status")
+    )
+    version = hashlib.md5(json.dumps(website_statuses, default=str).encode()).hexdigest()
+    return website_statuses, version
 
 
 @login_required
 def get_recent_traces(request):
     if request.method == "GET":
-        timeZ = request.GET.get('timeZ', '')
+        timeZ = get_time_zone(request)
         to_date = f"{date.today()} 23:59:59"
         from_date = f"{date.today() + timedelta(days=-3)} 00:00:00"
-        websites = Website.objects.all()
-        website_statuses = websites.values("status").annotate(status_count=Count("status"))
-        alias = {
-            "name": F("website__name"),
-            "status": F("website__status"),
-            "category": F("website__category"),
-            "last_traced": F('created_at')
-        }
-        recent_traces = (
-            TraceReportLog.objects.filter(created_at__lte=to_date, created_at__gte=from_date)
-            .select_related("website_id")
-            .values(
-                "website__name",
-                "website__status",
-                "units_traced",
-                "website",
-                "success",
-                "website__category",
-            )
-            .annotate(**alias)
-            .order_by("-created_at")
+        website_statuses, statuses_version = get_website_statuses()
+        recent_traces = recent_trace_values(
+            TraceReportLog.objects.filter(created_at__lte=to_date, created_at__gte=from_date), timeZ
         )
+        cursor = request.GET.get("cursor")
+        try:
+            recent_traces, next_cursor = keyset_page(
+                recent_traces,
+                cursor=cursor,
+                page_size=get_page_size(request.GET.get("page_size")),
+            )
+        except InvalidCursor as ex:
+            return JsonResponse({"status": 400, "response": "error", "message": str(ex)}, status=400)
+        # the first page also tells get_trace_changes where to start from
+        latest_cursor = None
+        if not cursor and recent_traces:
+            latest_cursor = encode_cursor(recent_traces[0]["created_at"], recent_traces[0]["id"])
         for result in recent_traces:
-             result['last_traced'] = timezone.localtime(result['last_traced'], pytz.timezone(timeZ)).strftime('%Y-%m-%d %I:%M:%S %p')
-        response = {"website_statuses": list(website_statuses), "recent_traces": list(recent_traces)}
+            del result["created_at"]
+        response = {
+            "website_statuses": website_statuses,
+            "statuses_version": statuses_version,
+            "recent_traces": recent_traces,
+            "next_cursor": next_cursor,
+            "latest_cursor": latest_cursor,
+        }
+        return JsonResponse(response, safe=False, status=200)
+    else:
+        return render(request, "public/405.html", status=405)
+
+
+@login_required
+def get_trace_changes(request):
+    if request.method == "GET":
+        timeZ = get_time_zone(request)
+        since = request.GET.get("since")
+        response = {"recent_traces": [], "latest_cursor": since, "has_more": False}
+        if since:
+            traces = recent_trace_values(TraceReportLog.objects.all(), timeZ)
+            try:
+                page, next_cursor = keyset_page(
+                    traces,
+                    cursor=since,
+                    page_size=get_page_size(request.GET.get("page_size")),
+                    descending=False,
+                )
+                late_traces = keyset_overlap(traces, since, TRACE_FEED_OVERLAP)
+            except InvalidCursor as ex:
+                return JsonResponse({"status": 400, "response": "error", "message": str(ex)}, status=400)
+            if page:
+                response["latest_cursor"] = encode_cursor(page[-1]["created_at"], page[-1]["id"])
+            response["has_more"] = next_cursor is not None
+            recent_traces = late_traces + page
+            for result in recent_traces:
+                del result["created_at"]
+            response["recent_traces"] = recent_traces
+        else:
+            latest = TraceReportLog.objects.order_by("-created_at", "-id").values("created_at", "id").first()
+            if latest:
+                response["latest_cursor"] = encode_cursor(latest["created_at"], latest["id"])
+
+        # status counts are only sent when they differ from the client's copy
+        website_statuses, statuses_version = get_website_statuses()
+        response["statuses_version"] = statuses_version
+        if request.GET.get("statuses_version") != statuses_version:
+            response["website_statuses"] = website_statuses
         return JsonResponse(response, safe=False, status=200)
     else:
         return render(request, "public/405.html", status=405)
@@ -0,0 +1,180 @@
+import zipfile
+from xml.sax.saxutils import escape
+
+# Minimal SpreadsheetML package written row by row into a zip stream, so an
+# export never holds more than one chunk of rows in memory.
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    "</Types>"
+)
+
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    "</Relationships>"
+)
+
+WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+    "</workbook>"
+)
+
+WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    "</Relationships>"
+)
+
+# cellXfs: 0 = default, 1 = title (white fill), 2 = header (bold, header colour), 3 = body
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2">'
+    '<font><sz val="12"/><color rgb="FF000000"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="12"/><color rgb="FF000000"/><name val="Calibri"/></font>'
+    "</fonts>"
+    '<fills count="4">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFFFFFFF"/></patternFill></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFE2DED0"/></patternFill></fill>'
+    "</fills>"
+    '<borders count="1"><border/></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="0" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="3" borderId="0" xfId="0" applyFont="1" applyFill="1"/>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    "</cellXfs>"
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    "</styleSheet>"
+)
+
+TITLE_STYLE = 1
+HEADER_STYLE = 2
+BODY_STYLE = 3
+
+
+def column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def cell(row, column, value, style=BODY_STYLE):
+    ref = f"{column_letter(column)}{row}"
+    if value is None:
+        return f'<c r="{ref}" s="{style}"/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}" s="{style}"><v>{value}</v></c>'
+    return f'<c r="{ref}" s="{style}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+class ZipStreamBuffer:
+    # write-only sink for ZipFile; zipfile falls back to data descriptors
+    # because there is no tell()/seek(), so nothing has to be rewound
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# yields the .xlsx bytes while consuming rows (iterables of cell values)
+def stream_xlsx(rows, columns, sheet_name="Sheet1", title=None, chunk_size=500):
+    buffer = ZipStreamBuffer()
+    archive = zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED)
+    archive.writestr("[Content_Types].xml", CONTENT_TYPES)
+    archive.writestr("_rels/.rels", ROOT_RELS)
+    archive.writestr("xl/workbook.xml", WORKBOOK.format(sheet_name=escape(sheet_name, {'"': "&quot;"})))
+    archive.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS)
+    archive.writestr("xl/styles.xml", STYLES)
+    yield buffer.drain()
+
+    header_row = 3 if title else 1
+    last_column = column_letter(len(columns) - 1)
+    with archive.open("xl/worksheets/sheet1.xml", mode="w", force_zip64=True) as sheet:
+        # freeze everything above the first data row and the first column
+        sheet.write(
+            (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetViews><sheetView workbookViewId="0">'
+                f'<pane xSplit="1" ySplit="{header_row}" topLeftCell="B{header_row + 1}" '
+                'activePane="bottomRight" state="frozen"/>'
+                "</sheetView></sheetViews>"
+                "<cols>"
+                + "".join(
+                    f'<col min="{index + 1}" max="{index + 1}" width="{len(column) + 4}" customWidth="1"/>'
+                    for index, column in enumerate(columns)
+                )
+                + "</cols><sheetData>"
+            ).encode()
+        )
+        if title:
+            sheet.write(f'<row r="1">{cell(1, 0, title, TITLE_STYLE)}</row>'.encode())
+        sheet.write(
+            (
+                f'<row r="{header_row}">'
+                + "".join(cell(header_row, index, column, HEADER_STYLE) for index, column in enumerate(columns))
+                + "</row>"
+            ).encode()
+        )
+        yield buffer.drain()
+
+        row_number = header_row + 1
+        pending = []
+        for row in rows:
+            pending.append(
+                f'<row r="{row_number}">'
+                + "".join(cell(row_number, index, value) for index, value in enumerate(row))
+                + "</row>"
+            )
+            row_number += 1
+            if len(pending) >= chunk_size:
+                sheet.write("".join(pending).encode())
+                pending.clear()
+                yield buffer.drain()
+        sheet.write("".join(pending).encode())
+
+        sheet.write("</sheetData>".encode())
+        if title:
+            sheet.write(f'<mergeCells count="1"><mergeCell ref="A1:{last_column}1"/></mergeCells>'.encode())
+        sheet.write("</worksheet>".encode())
+    archive.close()
+    yield buffer.drain()